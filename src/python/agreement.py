@@ -1,29 +1,60 @@
 #!/usr/bin/env python3
 
 
-"""Computes agreement on edges between two annotators.
+"""Computes agreement on edges between annotators.
+
+Given N annotations of the same file, computes agreement for every pair of
+them. Each annotation is parsed and checked once, however many pairs it is
+in. Annotations can be files or, with --rev, the same file in several git
+revisions (e.g. annotator branches):
+
+    agreement.py --rev alice --rev bob --rev carol data/1984/de/001.cusf
 
 Only predicates fully annotated by both annotators are considered.
 
 Annotators are counted as in agreement on an edge if they have at least one
 label in common (multiple labels per annotator can come from
 ambiguity/uncertainty/figurativity).
+
+The edges of each annotation and the counts for each pair are cached by the
+hash of the file contents, so adding an annotator only computes the new
+pairs. With --sidecar, files are loaded from their binary sidecars (see
+sidecar.py), which are compiled when missing or stale, instead of being
+parsed.
 """
 
 
 import argparse
 import collections
-from typing import Dict, Iterable, List, Tuple
+import hashlib
+import io
+import itertools
+import subprocess
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
 
 
+import cache
 import cusf
+import diagnostics
 import labels
+import sidecar
+
+
+EdgesMap = Dict[Tuple[str, str], Dict[str, str]]
 
 
-def create_pred_edges_map(sentences: Iterable[cusf.Sentence]) -> \
-        Dict[Tuple[str, str], Dict[str, str]]:
+def code_version() -> str:
+    """Hashes this module, so cached counts are dropped when it changes"""
+    with open(__file__, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def create_pred_edges_map(sentences: Iterable[cusf.Sentence],
+        collector: diagnostics.Collector=diagnostics.LOG) -> EdgesMap:
     result = {}
     for sentence in sentences:
+        if not sentence.has_frame_labels():
+            continue # no frame can be completely annotated
         seen = set()
         for frame in sentence.frames:
             if not isinstance(frame, cusf.Frame):
@@ -33,7 +64,7 @@ def create_pred_edges_map(sentences: Iterable[cusf.Sentence]) -> \
                 continue # skip duplicate frame annotations
             if not frame.is_completely_annotated():
                 continue
-            ok, _ = frame.check(sentence, 0)
+            ok, _ = frame.check(sentence, 0, collector)
             if not ok:
                 continue
             head_label_map = collections.defaultdict(str)
@@ -59,33 +90,172 @@ def count_matches(head_label_map_1, head_label_map_2, simplify=False):
     return edge_count, match_count
 
 
-if __name__ == '__main__':
-    arg_parser = argparse.ArgumentParser(description=__doc__)
-    arg_parser.add_argument('file1', type=argparse.FileType())
-    arg_parser.add_argument('file2', type=argparse.FileType())
-    arg_parser.add_argument('--ignore-preds', type=argparse.FileType())
-    arg_parser.add_argument('--simplify', action='store_true')
-    args = arg_parser.parse_args()
-    map1 = create_pred_edges_map(cusf.read(args.file1))
-    map2 = create_pred_edges_map(cusf.read(args.file2))
-    if args.ignore_preds:
-        ignore_map = create_pred_edges_map(cusf.read(args.ignore_preds))
-    else:
-        ignore_map = {}
+class Annotation:
+    """The text of one annotated file, with its edges computed on demand
+
+    If path is given, sentences are loaded from the sidecar of that file
+    rather than parsed from the text."""
+
+    def __init__(self, name: str, text: str,
+            result_cache: Optional[cache.ResultCache]=None,
+            path: Optional[str]=None):
+        self.name = name
+        self.text = text
+        self.hash = hashlib.sha256(text.encode()).hexdigest()
+        self.result_cache = result_cache
+        self.path = path
+        self._edges: Optional[EdgesMap] = None
+
+    def sentences(self) -> Iterable[cusf.Sentence]:
+        if self.path is not None:
+            return sidecar.load(self.path)
+        return cusf.read(io.StringIO(self.text), lazy=True)
+
+    @property
+    def edges(self) -> EdgesMap:
+        if self._edges is None:
+            key = None
+            if self.result_cache is not None:
+                key = self.result_cache.key('edges', code_version(), self.hash)
+                cached = self.result_cache.get(key)
+                if cached is not None:
+                    edges, rows = cached
+                    diagnostics.LOG.extend(rows)
+                    self._edges = {
+                        (sent_id, head): collections.defaultdict(str, args)
+                        for sent_id, head, args in edges
+                    }
+                    return self._edges
+            found = diagnostics.ListCollector()
+            self._edges = create_pred_edges_map(self.sentences(), found)
+            diagnostics.LOG.extend(found.diagnostics)
+            if key is not None:
+                self.result_cache.put(key, [[
+                    [sent_id, head, args]
+                    for (sent_id, head), args in self._edges.items()
+                ], found.diagnostics])
+        return self._edges
+
+
+class PairCounts(NamedTuple):
+    common: int # predicates
+    total1: int # edges of annotator 1
+    match1: int # ...matched by annotator 2
+    total2: int
+    match2: int
+
+
+def compare(map1: EdgesMap, map2: EdgesMap, ignore_map: EdgesMap,
+        simplify: bool=False) -> PairCounts:
     common_predicates = (set(map1.keys()) & set(map2.keys())) - set(ignore_map.keys())
-    print(f'{len(common_predicates)} common predicates')
     total1 = 0
     match1 = 0
     total2 = 0
     match2 = 0
     for pred in common_predicates:
-        head_label_map_1 = map1[pred]
-        head_label_map_2 = map2[pred]
-        edge_count, match_count = count_matches(head_label_map_1, head_label_map_2, args.simplify)
+        # Copies, because looking up missing heads adds them
+        head_label_map_1 = collections.defaultdict(str, map1[pred])
+        head_label_map_2 = collections.defaultdict(str, map2[pred])
+        edge_count, match_count = count_matches(head_label_map_1, head_label_map_2, simplify)
         total1 += edge_count
         match1 += match_count
-        edge_count, match_count = count_matches(head_label_map_2, head_label_map_1, args.simplify)
+        edge_count, match_count = count_matches(head_label_map_2, head_label_map_1, simplify)
         total2 += edge_count
         match2 += match_count
-    print(f"{match1}/{total1} ({match1 / total1}) of annotators 1's edges matched by annotator 2")
-    print(f"{match2}/{total2} ({match2 / total2}) of annotators 2's edges matched by annotator 1")
+    return PairCounts(len(common_predicates), total1, match1, total2, match2)
+
+
+def compare_all(annotations: List[Annotation], ignore: Optional[Annotation]=None,
+        simplify: bool=False, result_cache: Optional[cache.ResultCache]=None) \
+        -> Iterable[Tuple[Annotation, Annotation, PairCounts]]:
+    """Compares every pair of annotations, in order"""
+    ignore_hash = ignore.hash if ignore else None
+    version = code_version()
+    for a1, a2 in itertools.combinations(annotations, 2):
+        key = None
+        if result_cache is not None:
+            key = result_cache.key('agreement', version, a1.hash, a2.hash,
+                    ignore_hash, simplify)
+            cached = result_cache.get(key)
+            if cached is not None:
+                yield a1, a2, PairCounts(*cached)
+                continue
+        counts = compare(a1.edges, a2.edges, ignore.edges if ignore else {},
+                simplify)
+        if key is not None:
+            result_cache.put(key, list(counts))
+        yield a1, a2, counts
+
+
+def git_show(rev: str, path: str) -> str:
+    return subprocess.run(['git', 'show', f'{rev}:./{path}'], check=True,
+            capture_output=True, text=True).stdout
+
+
+def ratio(match: int, total: int) -> str:
+    return f'{match}/{total} ({match / total if total else float("nan")})'
+
+
+def add_arguments(arg_parser: argparse.ArgumentParser):
+    """Adds the options for choosing annotations and caching"""
+    arg_parser.add_argument('file', nargs='+',
+            help='annotated files, or one file with --rev')
+    arg_parser.add_argument('--rev', action='append', default=[],
+            help='git revision to read the file from (repeatable)')
+    arg_parser.add_argument('--ignore-preds', metavar='FILE')
+    arg_parser.add_argument('--simplify', action='store_true')
+    arg_parser.add_argument('--sidecar', action='store_true',
+            help='load files from their binary sidecars, compiling them if '
+            'needed, instead of parsing them (not with --rev)')
+    arg_parser.add_argument('--cache', metavar='FILE', default=cache.DEFAULT_PATH,
+            help=f'result cache file, safe to delete (default: {cache.DEFAULT_PATH})')
+    arg_parser.add_argument('--no-cache', dest='cache', action='store_const',
+            const=None, help='do not use the result cache')
+
+
+def load_annotations(arg_parser: argparse.ArgumentParser,
+        args: argparse.Namespace, result_cache: Optional[cache.ResultCache]) \
+        -> Tuple[List[Annotation], Optional[Annotation]]:
+    """Returns the annotations and the --ignore-preds annotation, if any"""
+    if args.rev:
+        if len(args.file) != 1:
+            arg_parser.error('--rev needs exactly one file')
+        if args.sidecar:
+            arg_parser.error('--sidecar cannot be used with --rev')
+        path, = args.file
+        annotations = [Annotation(f'{r}:{path}', git_show(r, path), result_cache)
+                for r in args.rev]
+    else:
+        annotations = []
+        for path in args.file:
+            with open(path) as f:
+                annotations.append(Annotation(path, f.read(), result_cache,
+                        path if args.sidecar else None))
+    if len(annotations) < 2:
+        arg_parser.error('need at least two annotations')
+    ignore = None
+    if args.ignore_preds:
+        with open(args.ignore_preds) as f:
+            ignore = Annotation(args.ignore_preds, f.read(), result_cache,
+                    args.ignore_preds if args.sidecar else None)
+    return annotations, ignore
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(arg_parser)
+    args = arg_parser.parse_args()
+    result_cache = cache.ResultCache(args.cache) if args.cache else None
+    annotations, ignore = load_annotations(arg_parser, args, result_cache)
+    try:
+        for a1, a2, counts in compare_all(annotations, ignore, args.simplify,
+                result_cache):
+            if len(annotations) > 2:
+                print(f'{a1.name} vs. {a2.name}:')
+            print(f'{counts.common} common predicates')
+            print(f"{ratio(counts.match1, counts.total1)} of annotators 1's edges matched by annotator 2")
+            print(f"{ratio(counts.match2, counts.total2)} of annotators 2's edges matched by annotator 1")
+    finally:
+        if result_cache is not None:
+            result_cache.close()
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+
+
+"""Computes chance-corrected agreement on edges between annotators.
+
+Takes the same arguments as agreement.py and reports Cohen's kappa for every
+pair of annotations, Fleiss' kappa over all of them and Krippendorff's alpha
+(which allows for predicates not fully annotated by everyone). With
+--bootstrap N, each comes with a confidence interval from N resamples. With
+--confusion, also prints label confusion counts for every pair.
+
+The units are edges, i.e., (predicate, argument head) pairs, of predicates
+fully annotated by at least two annotators. An annotator who has the
+predicate but not the argument contributes the label _. As in agreement.py,
+two labels agree if they have at least one part in common, and --simplify
+drops the m-/x- prefixes of parts. Chance agreement is computed for this
+notion of agreement, from the label combinations each annotator used.
+Confidence intervals resample predicates rather than edges, since the edges
+of one predicate are not independent.
+"""
+
+
+import argparse
+import collections
+import itertools
+from typing import Callable, Dict, FrozenSet, List, NamedTuple, Optional, \
+        Tuple
+
+
+import numpy as np
+
+
+import agreement
+import cache
+import labels
+
+
+NO_ARG = '_'
+CORE_ROLES = sorted(frozenset().union(*labels.CORE_ROLES.values()))
+NONCORE_ROLES = sorted(labels.NONCORE_ROLES)
+BOOTSTRAP_CHUNK = 64 # resamples computed at once, bounding memory
+
+
+class LabelEncoder:
+    """Gives label parts and combinations of them integer IDs
+
+    Parts are numbered in the order of the role vocabulary of labels.py, then
+    in the order unknown parts are seen. A label is encoded as the ID of its
+    set of parts."""
+
+    def __init__(self, simplify: bool=False):
+        self.simplify = simplify
+        if simplify:
+            vocabulary = sorted(set(CORE_ROLES) | set(NONCORE_ROLES))
+        else:
+            vocabulary = CORE_ROLES + [f'{p}-{r}' for p in ('m', 'x')
+                    for r in NONCORE_ROLES]
+        self.parts: List[str] = [NO_ARG] + vocabulary
+        self.part_ids: Dict[str, int] = {p: i for i, p in enumerate(self.parts)}
+        self.sets: List[FrozenSet[int]] = []
+        self.set_ids: Dict[FrozenSet[int], int] = {}
+
+    def part_id(self, part: str) -> int:
+        if self.simplify:
+            part = labels.simplify(part)
+        if part not in self.part_ids:
+            self.part_ids[part] = len(self.parts)
+            self.parts.append(part)
+        return self.part_ids[part]
+
+    def encode(self, label: str) -> int:
+        if label:
+            key = frozenset(self.part_id(p) for p in labels.split_label(label))
+        else:
+            key = frozenset((self.part_ids[NO_ARG],))
+        if key not in self.set_ids:
+            self.set_ids[key] = len(self.sets)
+            self.sets.append(key)
+        return self.set_ids[key]
+
+    def subsets(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Numbers the nonempty subsets of the label sets
+
+        Returns (starts, subsets, signs): the subsets of set i are
+        subsets[starts[i]:starts[i + 1]], and signs gives +1 or -1 for each
+        subset according to its size, so that by inclusion-exclusion, two
+        sets agree iff the signs of their common subsets sum to 1."""
+        ids: Dict[FrozenSet[int], int] = {}
+        signs = []
+        starts = [0]
+        subsets = []
+        for parts in self.sets:
+            for size in range(1, len(parts) + 1):
+                for subset in itertools.combinations(sorted(parts), size):
+                    subset = frozenset(subset)
+                    if subset not in ids:
+                        ids[subset] = len(ids)
+                        signs.append(1.0 if size % 2 else -1.0)
+                    subsets.append(ids[subset])
+            starts.append(len(subsets))
+        return np.array(starts), np.array(subsets, dtype=np.int64), \
+                np.array(signs)
+
+
+class Units(NamedTuple):
+    values: np.ndarray # (units × annotators) label set IDs, -1 if missing
+    preds: np.ndarray # (units,) index of each unit's predicate
+    sets: List[FrozenSet[int]] # the parts of each label set
+    subset_starts: np.ndarray # see LabelEncoder.subsets
+    subsets: np.ndarray
+    signs: np.ndarray
+    parts: List[str]
+
+
+def build_units(maps: List[agreement.EdgesMap],
+        ignore_map: Optional[agreement.EdgesMap]=None,
+        simplify: bool=False) -> Units:
+    encoder = LabelEncoder(simplify)
+    have = collections.defaultdict(list)
+    for j, m in enumerate(maps):
+        for pred in m:
+            have[pred].append(j)
+    ignore_map = ignore_map or {}
+    rows = []
+    preds = []
+    pred_count = 0
+    for pred, annotators in have.items():
+        if len(annotators) < 2 or pred in ignore_map:
+            continue
+        heads = dict.fromkeys(h for j in annotators for h in maps[j][pred])
+        for head in heads:
+            row = [-1] * len(maps)
+            for j in annotators:
+                row[j] = encoder.encode(maps[j][pred].get(head, ''))
+            rows.append(row)
+            preds.append(pred_count)
+        pred_count += 1
+    return Units(
+        np.array(rows, dtype=np.int64).reshape(-1, len(maps)),
+        np.array(preds, dtype=np.int64),
+        encoder.sets,
+        *encoder.subsets(),
+        encoder.parts,
+    )
+
+
+def agree(units: Units, values1: np.ndarray, values2: np.ndarray) \
+        -> np.ndarray:
+    """1.0 where two label sets agree, else 0.0; missing values never agree"""
+    k = len(units.sets)
+    present = (values1 >= 0) & (values2 >= 0)
+    keys, inverse = np.unique(np.where(present, values1 * k + values2, -1),
+            return_inverse=True)
+    table = np.array([key >= 0 and bool(units.sets[key // k] & units.sets[key % k])
+            for key in keys.tolist()], dtype=float)
+    return table[inverse.reshape(-1)]
+
+
+class SubsetSums:
+    """Sums predicate weights by the subsets of label sets
+
+    Built once from the label sets of some units; calling it with weights
+    (samples × predicates) gives, for each subset, the weighted number of
+    those label sets containing it (samples × subsets)."""
+
+    def __init__(self, units: Units, values: np.ndarray):
+        present = values >= 0
+        values = values[present]
+        preds = units.preds[present]
+        starts = units.subset_starts[values]
+        counts = units.subset_starts[values + 1] - starts
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                counts)
+        subsets = units.subsets[np.repeat(starts, counts) + offsets]
+        preds = np.repeat(preds, counts)
+        # One entry per (subset, predicate), sorted by subset
+        pred_count = preds.max(initial=0) + 1
+        keys, self.counts = np.unique(subsets * pred_count + preds,
+                return_counts=True)
+        self.subsets, self.preds = np.divmod(keys, pred_count)
+        self.starts = np.flatnonzero(
+                np.r_[True, self.subsets[1:] != self.subsets[:-1]])
+        self.size = len(units.signs)
+
+    def __call__(self, weights: np.ndarray) -> np.ndarray:
+        result = np.zeros((weights.shape[0], self.size))
+        if self.counts.size:
+            # take, unlike indexing, gives a C-contiguous array, which
+            # reduceat is an order of magnitude faster on
+            entries = np.take(weights, self.preds, axis=1)
+            entries *= self.counts
+            result[:, self.subsets[self.starts]] = np.add.reduceat(entries,
+                    self.starts, axis=1)
+        return result
+
+
+def chance(units: Units, sums1: np.ndarray, sums2: np.ndarray) -> np.ndarray:
+    """Counts agreeing pairs of ratings, from SubsetSums of each side"""
+    return (sums1 * sums2) @ units.signs
+
+
+Statistic = Callable[[np.ndarray], np.ndarray]
+
+
+def per_pred(units: Units, values: np.ndarray) -> np.ndarray:
+    """Sums per-unit values by predicate"""
+    return np.bincount(units.preds, weights=values,
+            minlength=units.preds.max(initial=-1) + 1)
+
+
+def cohen_kappa(units: Units, a: int, b: int) -> Statistic:
+    """Cohen's kappa between annotators a and b
+
+    units must all be annotated by both. Returns a function from weights
+    (samples × predicates) to kappas (samples)."""
+    va = units.values[:, a]
+    vb = units.values[:, b]
+    n_p = per_pred(units, np.ones(len(va)))
+    agree_p = per_pred(units, agree(units, va, vb))
+    sums_a = SubsetSums(units, va)
+    sums_b = SubsetSums(units, vb)
+    def statistic(weights):
+        n = weights @ n_p
+        p_o = weights @ agree_p / n
+        p_e = chance(units, sums_a(weights), sums_b(weights)) / n ** 2
+        return (p_o - p_e) / (1 - p_e)
+    return statistic
+
+
+def fleiss_kappa(units: Units) -> Statistic:
+    """Fleiss' kappa, over units annotated by everyone"""
+    values = units.values
+    m = values.shape[1]
+    agreeing_pairs = sum(agree(units, values[:, i], values[:, j])
+            for i, j in itertools.combinations(range(m), 2))
+    n_p = per_pred(units, np.ones(len(values)))
+    p_p = per_pred(units, agreeing_pairs / (m * (m - 1) / 2))
+    sums = SubsetSums(units._replace(preds=np.repeat(units.preds, m)),
+            values.reshape(-1))
+    def statistic(weights):
+        n = weights @ n_p
+        p_o = weights @ p_p / n
+        s = sums(weights)
+        p_e = chance(units, s, s) / (m * n) ** 2
+        return (p_o - p_e) / (1 - p_e)
+    return statistic
+
+
+def krippendorff_alpha(units: Units) -> Statistic:
+    """Krippendorff's alpha with agree/disagree distances
+
+    Units may lack values from some annotators."""
+    values = units.values
+    m = values.shape[1]
+    present = values >= 0
+    m_u = present.sum(1)
+    disagreeing_pairs = sum(
+        (present[:, i] & present[:, j]) - agree(units, values[:, i], values[:, j])
+        for i, j in itertools.combinations(range(m), 2)
+    )
+    n_p = per_pred(units, m_u)
+    d_p = per_pred(units, 2 * disagreeing_pairs / (m_u - 1))
+    sums = SubsetSums(units._replace(preds=np.repeat(units.preds, m)),
+            values.reshape(-1))
+    def statistic(weights):
+        n = weights @ n_p
+        d_o = weights @ d_p / n
+        s = sums(weights)
+        d_e = (n ** 2 - chance(units, s, s)) / (n * (n - 1))
+        return 1 - d_o / d_e
+    return statistic
+
+
+class Estimate(NamedTuple):
+    value: float
+    low: float
+    high: float
+    units: int
+
+
+def estimate(make_statistic: Callable[[Units], Statistic], units: Units,
+        mask: np.ndarray, resamples: int, rng: np.random.Generator,
+        level: float=0.95) -> Estimate:
+    """Computes a statistic and a bootstrap interval over predicates
+
+    make_statistic is applied to the units selected by mask, with predicates
+    renumbered from 0."""
+    count = int(mask.sum())
+    if not count:
+        return Estimate(float('nan'), float('nan'), float('nan'), 0)
+    _, preds = np.unique(units.preds[mask], return_inverse=True)
+    selected = units._replace(values=units.values[mask], preds=preds.reshape(-1))
+    pred_count = preds.max() + 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        statistic = make_statistic(selected)
+        value = statistic(np.ones((1, pred_count)))[0]
+        samples = []
+        for start in range(0, resamples, BOOTSTRAP_CHUNK):
+            size = min(BOOTSTRAP_CHUNK, resamples - start)
+            draws = rng.integers(pred_count, size=(size, pred_count))
+            draws += np.arange(size)[:, None] * pred_count
+            weights = np.bincount(draws.reshape(-1),
+                    minlength=size * pred_count).reshape(size, pred_count)
+            samples.append(statistic(weights))
+    if samples:
+        samples = np.concatenate(samples)
+        low, high = np.nanquantile(samples, [(1 - level) / 2, (1 + level) / 2])
+    else:
+        low = high = float('nan')
+    return Estimate(value, low, high, count)
+
+
+def confusion(units: Units, a: int, b: int) -> np.ndarray:
+    """Label part confusion counts (parts × parts) between a and b
+
+    Each edge contributes a total of 1, spread evenly over the combinations
+    of its parts in both annotations."""
+    mask = (units.values[:, a] >= 0) & (units.values[:, b] >= 0)
+    k = len(units.sets)
+    keys, counts = np.unique(units.values[mask, a] * k + units.values[mask, b],
+            return_counts=True)
+    result = np.zeros((len(units.parts), len(units.parts)))
+    for key, count in zip(keys.tolist(), counts.tolist()):
+        parts1 = list(units.sets[key // k])
+        parts2 = list(units.sets[key % k])
+        result[np.ix_(parts1, parts2)] += count / (len(parts1) * len(parts2))
+    return result
+
+
+def format_estimate(e: Estimate) -> str:
+    interval = '' if np.isnan(e.low) else f' [{e.low:.3f}, {e.high:.3f}]'
+    return f'{e.value:.3f}{interval} ({e.units} edges)'
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    agreement.add_arguments(arg_parser)
+    arg_parser.add_argument('--confusion', action='store_true',
+            help='print label confusion counts for every pair')
+    arg_parser.add_argument('--bootstrap', metavar='N', type=int, default=0,
+            help='number of bootstrap resamples for confidence intervals, '
+            'e.g. 1000, which takes over ten times as long as the point '
+            'estimates on the whole corpus (default: %(default)s, no intervals)')
+    arg_parser.add_argument('--seed', type=int, default=0)
+    args = arg_parser.parse_args()
+    result_cache = cache.ResultCache(args.cache) if args.cache else None
+    annotations, ignore = agreement.load_annotations(arg_parser, args,
+            result_cache)
+    try:
+        units = build_units([a.edges for a in annotations],
+                ignore.edges if ignore else None, args.simplify)
+    finally:
+        if result_cache is not None:
+            result_cache.close()
+    rng = np.random.default_rng(args.seed)
+    present = units.values >= 0
+    print("Cohen's kappa:")
+    for a, b in itertools.combinations(range(len(annotations)), 2):
+        e = estimate(lambda u: cohen_kappa(u, a, b), units,
+                present[:, a] & present[:, b], args.bootstrap, rng)
+        print(f'  {annotations[a].name} vs. {annotations[b].name}: '
+                f'{format_estimate(e)}')
+    if len(annotations) > 2:
+        e = estimate(fleiss_kappa, units, present.all(1), args.bootstrap, rng)
+        print(f"Fleiss' kappa: {format_estimate(e)}")
+    e = estimate(krippendorff_alpha, units, present.sum(1) >= 2, args.bootstrap,
+            rng)
+    print(f"Krippendorff's alpha: {format_estimate(e)}")
+    if args.confusion:
+        for a, b in itertools.combinations(range(len(annotations)), 2):
+            print()
+            print(f'{annotations[a].name}\t{annotations[b].name}\tcount')
+            matrix = confusion(units, a, b)
+            for i, j in zip(*np.nonzero(matrix)):
+                print(f'{units.parts[i]}\t{units.parts[j]}\t{matrix[i, j]:g}')
@@ -0,0 +1,888 @@
+#!/usr/bin/env python3
+
+
+"""Benchmarks for the CUSF tools.
+
+Run from the repository root, e.g.:
+
+    python3 src/python/bench.py read
+
+The stages benchmark times each stage of processing (reading, filling,
+checking, writing, label checking and edge extraction) on every directory
+of the data and on synthetic long sentences, with frames labelled at random
+but reproducibly. To see whether a change makes things slower, save results
+before and compare after:
+
+    python3 src/python/bench.py stages --json before.json
+    python3 src/python/bench.py stages --compare before.json
+
+--compare exits with status 1 if any result got slower by more than the
+threshold.
+"""
+
+
+import argparse
+import gc
+import glob
+import io
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, Iterable, List, Tuple
+
+
+from pyconll.exception import ParseError
+import numpy as np
+import pyconll
+
+
+import agreement
+import agreement_stats
+import blocks
+import burst
+import cusf
+import diagnostics
+import labels
+import lsp
+import sidecar
+import store
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'data')
+RESULTS: Dict[str, float] = {} # benchmark/name -> seconds, for --json
+current_benchmark = '' # set by start_benchmark
+SYNTHETIC_SENTENCES = 20 # per length, for the stages benchmark
+NOISE = 0.001 # seconds a result may get slower by without being a regression
+
+
+def data_files(root: str=DATA_DIR) -> List[str]:
+    return sorted(glob.glob(os.path.join(root, '**', '*.cusf'), recursive=True))
+
+
+def load_texts(files: Iterable[str]) -> List[str]:
+    texts = []
+    for path in files:
+        with open(path) as f:
+            texts.append(f.read())
+    return texts
+
+
+def best_of(repeat: int, fn: Callable[[], object]) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def start_benchmark(name: str):
+    """Makes report file the following results under the benchmark name"""
+    global current_benchmark
+    current_benchmark = name
+
+
+def report(name: str, seconds: float, baseline: float=None):
+    RESULTS[f'{current_benchmark}/{name}'] = seconds
+    line = f'{name:<32} {seconds * 1000:10.1f} ms'
+    if baseline is not None:
+        line += f'  ({baseline / seconds:.2f}x)'
+    print(line)
+
+
+def read_parse_and_catch(f) -> Iterable[cusf.Sentence]:
+    """The old cusf.read: tries to parse every block as CoNLL-U."""
+    current_sentence = None
+    lineno = 1
+    for block in blocks.read(f):
+        try:
+            new_sentence = cusf.Sentence(
+                pyconll.load_from_string('\n'.join(block)),
+                lineno,
+            )
+            if current_sentence:
+                yield current_sentence
+            current_sentence = new_sentence
+        except ParseError:
+            current_sentence.add_frame(block, lineno)
+        lineno += len(block) + 1
+    if current_sentence:
+        yield current_sentence
+
+
+def bench_read(args: argparse.Namespace):
+    texts = load_texts(data_files(args.data))
+    def run(reader):
+        for text in texts:
+            for _ in reader(io.StringIO(text)):
+                pass
+    old = best_of(args.repeat, lambda: run(read_parse_and_catch))
+    new = best_of(args.repeat, lambda: run(cusf.read))
+    report('read (parse-and-catch)', old)
+    report('read (block classifier)', new, old)
+
+
+def bench_lazy(args: argparse.Namespace):
+    texts = load_texts(data_files(args.data))
+    def roundtrip(lazy):
+        for text in texts:
+            out = io.StringIO()
+            for sentence in cusf.read(io.StringIO(text), lazy=lazy):
+                sentence.write(out)
+    def metadata(lazy):
+        for text in texts:
+            for sentence in cusf.read(io.StringIO(text), lazy=lazy):
+                sentence.syntax[0].id
+    for name, fn in (('read+write', roundtrip), ('read metadata', metadata)):
+        eager = best_of(args.repeat, lambda: fn(False))
+        lazy = best_of(args.repeat, lambda: fn(True))
+        report(f'{name} (eager frames)', eager)
+        report(f'{name} (lazy frames)', lazy, eager)
+
+
+def bench_sidecar(args: argparse.Namespace):
+    """Compares cusf.read with loading from binary sidecars, touching the
+    frames, syntax and tree of each sentence
+
+    Sidecars are compiled into a temporary copy of the data beforehand."""
+    with tempfile.TemporaryDirectory() as tmp:
+        files = []
+        for i, path in enumerate(data_files(args.data)):
+            copy = os.path.join(tmp, f'{i}.cusf')
+            with open(path) as f, open(copy, 'w') as g:
+                g.write(f.read())
+            sidecar.compile(copy)
+            files.append(copy)
+        def run(loader):
+            for path in files:
+                for sentence in loader(path):
+                    sentence.frames
+                    if sentence.syntax:
+                        sentence.syntax[0][0].lemma
+                        try:
+                            sentence.tree
+                        except ValueError:
+                            pass
+        def read(path):
+            with open(path) as f:
+                yield from cusf.read(f)
+        baseline = None
+        previous_backend = cusf.syntax_backend
+        try:
+            for backend in cusf.SYNTAX_BACKENDS:
+                cusf.syntax_backend = backend
+                seconds = best_of(args.repeat, lambda: run(read))
+                report(f'cusf.read ({backend})', seconds, baseline)
+                baseline = baseline or seconds
+        finally:
+            cusf.syntax_backend = previous_backend
+        report('sidecar', best_of(args.repeat, lambda: run(sidecar.load)),
+                baseline)
+        size = sum(os.path.getsize(path) for path in files)
+        sidecar_size = sum(os.path.getsize(sidecar.path_for(path))
+                for path in files)
+        print(f'sidecars: {sidecar_size / size:.2f}x the size of the files')
+
+
+def bench_store(args: argparse.Namespace):
+    """Compares finding frames by head lemma by reading files and in a store"""
+    files = data_files(args.data)
+    lemma = 'sagen'
+    def scan():
+        found = []
+        for path in files:
+            with open(path) as f:
+                for sentence in cusf.read(f):
+                    for frame in sentence.frames:
+                        token = sentence.syntax[0][frame.head]
+                        if token.lemma == lemma:
+                            found.append(frame)
+        return found
+    with tempfile.TemporaryDirectory() as tmp:
+        db = store.connect(os.path.join(tmp, 'store.sqlite3'))
+        start = time.perf_counter()
+        for _ in store.import_files(db, files):
+            pass
+        report('store import', time.perf_counter() - start)
+        old = best_of(args.repeat, scan)
+        new = best_of(args.repeat, lambda: list(store.query(db, lemma=lemma)))
+        db.close()
+    report(f'frames with lemma {lemma} (read)', old)
+    report(f'frames with lemma {lemma} (store)', new, old)
+
+
+def bench_lsp(args: argparse.Namespace):
+    """Compares checking a whole document with the language server's
+    incremental check after typing a character into a frame label"""
+    with open(args.synthetic_source) as f:
+        text = f.read()
+    lines = text.split('\n')
+    frame_lines = [i for i, line in enumerate(lines)
+            if line.startswith('[') and i > 0 and not lines[i - 1]]
+    lineno = frame_lines[len(frame_lines) // 2]
+    def full():
+        lsp.Document('bench', text).diagnostics()
+    document = lsp.Document('bench', text)
+    document.diagnostics()
+    def keystrokes():
+        for i, char in enumerate('EVENT'):
+            position = {'line': lineno, 'character': 1 + i}
+            document.edit({'range': {'start': position, 'end': position},
+                    'text': char})
+            document.diagnostics()
+        start = {'line': lineno, 'character': 1}
+        end = {'line': lineno, 'character': 6}
+        document.edit({'range': {'start': start, 'end': end}, 'text': ''})
+        document.diagnostics()
+    old = best_of(args.repeat, full)
+    new = best_of(args.repeat, keystrokes) / 6
+    report('check document (full)', old)
+    report('check document (keystroke)', new, old)
+
+
+STARTUP_MODULES = ('blocks', 'burst', 'add_sent_ids_and_text', 'cusf',
+        'check', 'agreement', 'lsp')
+
+
+def import_time(module: str) -> Tuple[float, List[str]]:
+    """Imports module in a fresh interpreter with -X importtime, returning
+    the cumulative import time of module and the names of all modules
+    imported on the way"""
+    # allow writing bytecode, so that repeated runs measure warm imports
+    env = {k: v for k, v in os.environ.items()
+            if k != 'PYTHONDONTWRITEBYTECODE'}
+    result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=env, capture_output=True, text=True, check=True)
+    seconds = 0.0
+    names = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '[us]' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        names.append(name.strip())
+        if name.strip() == module:
+            seconds = int(cumulative) / 1e6
+    return seconds, names
+
+
+def bench_startup(args: argparse.Namespace):
+    """Measures how long the scripts take to import, and makes sure none of
+    them imports pyconll before it parses anything"""
+    baseline, _ = min(import_time('pyconll') for _ in range(args.number))
+    for module in STARTUP_MODULES:
+        seconds, names = min(import_time(module) for _ in range(args.number))
+        if any(n == 'pyconll' or n.startswith('pyconll.') for n in names):
+            raise AssertionError(f'importing {module} imports pyconll')
+        report(f'import {module}', seconds)
+    report('import pyconll (deferred)', baseline)
+
+
+def random_edges_maps(args: argparse.Namespace, count: int) \
+        -> List[agreement.EdgesMap]:
+    """Labels every frame of the data at random, count times"""
+    rng = random.Random(0)
+    roles = agreement_stats.CORE_ROLES
+    frames = []
+    for text in load_texts(data_files(args.data)):
+        for sentence in cusf.read(io.StringIO(text)):
+            sent_id = sentence.syntax[0].id
+            frames.extend(((sent_id, f.head), [a.head for a in f.args])
+                    for f in sentence.frames)
+    maps = []
+    for _ in range(count):
+        edges = {}
+        for key, heads in frames:
+            if rng.random() < 0.9:
+                edges[key] = {h: ' || '.join(rng.sample(roles, rng.choice((1, 1, 2))))
+                        for h in heads if rng.random() < 0.9}
+        maps.append(edges)
+    return maps
+
+
+def bench_stats(args: argparse.Namespace):
+    """Compares raw pairwise match counts with the vectorized statistics"""
+    maps = random_edges_maps(args, 4)
+    pairs = list(itertools.combinations(maps, 2))
+    def loop():
+        for map1, map2 in pairs:
+            agreement.compare(map1, map2, {})
+    def stats(resamples):
+        units = agreement_stats.build_units(maps)
+        rng = np.random.default_rng(0)
+        present = units.values >= 0
+        for a, b in itertools.combinations(range(len(maps)), 2):
+            agreement_stats.estimate(
+                lambda u: agreement_stats.cohen_kappa(u, a, b), units,
+                present[:, a] & present[:, b], resamples, rng)
+        agreement_stats.estimate(agreement_stats.fleiss_kappa, units,
+                present.all(1), resamples, rng)
+        agreement_stats.estimate(agreement_stats.krippendorff_alpha, units,
+                present.sum(1) >= 2, resamples, rng)
+    edges = sum(len(m) for m in maps[0].values())
+    print(f'4 annotators, {edges} edges each:')
+    report('match counts (dict loop)', best_of(args.repeat, loop))
+    for resamples in (0, 1000):
+        report(f'kappas, alpha, {resamples} bootstraps',
+                best_of(args.repeat, lambda: stats(resamples)))
+
+
+class DictArg:
+    """An Arg as it used to be: dict-backed, labels not interned."""
+
+    def __init__(self, head, text, label, comment):
+        self.head = head
+        self.text = text
+        self.label = label
+        self.comment = comment
+
+    @staticmethod
+    def from_line(line):
+        m = cusf.FRAME_LINE.match(line)
+        return DictArg(m.group('head'), m.group('text'), m.group('label'),
+                m.group('comment') or '')
+
+
+class DictFrame:
+    """A Frame as it used to be: dict-backed, labels not interned."""
+
+    def __init__(self, head, text, label, comment):
+        self.head = head
+        self.text = text
+        self.label = label
+        self.comment = comment
+        self.args = []
+
+    @staticmethod
+    def from_block(block):
+        m = cusf.FRAME_LINE.match(block[0])
+        frame = DictFrame(m.group('head'), m.group('text'), m.group('label'),
+                m.group('comment') or '')
+        for line in block[1:]:
+            frame.args.append(DictArg.from_line(line))
+        return frame
+
+
+def bench_objects(args: argparse.Namespace):
+    """Measures memory per frame (with its args) over all data"""
+    frame_blocks = []
+    for text in load_texts(data_files(args.data)):
+        frame_blocks.extend(block for block in blocks.read(io.StringIO(text))
+                if cusf.is_frame_block(block))
+    for name, cls in (('dict-backed', DictFrame), ('slots, interned', cusf.Frame)):
+        tracemalloc.start()
+        frames = [cls.from_block(b) for b in frame_blocks]
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del frames
+        print(f'{name:<20} {len(frame_blocks)} frames  '
+                f'{size / len(frame_blocks):6.0f} bytes/frame')
+
+
+class UncachedSentence(cusf.Sentence):
+    """A sentence that rebuilds its tree on every access, as before."""
+
+    @property
+    def tree(self):
+        self._index = None
+        return self.syntax[0].to_tree()
+
+
+def long_sentence(args: argparse.Namespace) -> cusf.Sentence:
+    with open(args.long_sentence) as f:
+        sentence = next(iter(cusf.read(f)))
+    sentence.fill()
+    return sentence
+
+
+def bench_tree(args: argparse.Namespace):
+    sentence = long_sentence(args)
+    def run(cls):
+        s = copy_sentence(sentence, cls)
+        def once():
+            for _ in range(args.number):
+                s.syntax = s.syntax
+                s.fill()
+                s.check()
+        return best_of(args.repeat, once)
+    logging.disable(logging.WARNING)
+    old = run(UncachedSentence)
+    new = run(cusf.Sentence)
+    logging.disable(logging.NOTSET)
+    name = f'{len(sentence.syntax[0])} tokens, {len(sentence.frames)} frames'
+    print(f'fill+check, {name}, {args.number} times:')
+    report('tree (rebuilt per use)', old)
+    report('tree (cached per sentence)', new, old)
+
+
+class CursorSentence(cusf.Sentence):
+    """A sentence that adds missing frames by list insertion, as before."""
+
+    def add_missing_frames(self, expected_links):
+        cursor = 0 # index at which we insert the next missing frame
+        for tree in cusf.subtrees(self.tree):
+            if cusf.is_semantic_predicate(tree):
+                frame_already_present = False
+                for index, frame in enumerate(self.frames):
+                    if frame.head == tree.data.id:
+                        frame_already_present = True
+                        frame.fill_args(expected_links[frame.head])
+                        cursor = index + 1
+                        break
+                if not frame_already_present:
+                    frame = cusf.Frame(tree.data.id,
+                            self.predicate_text(tree.data.id))
+                    frame.fill_args(expected_links[frame.head])
+                    self.frames.insert(cursor, frame)
+                    cursor += 1
+        self.invalidate_frames()
+
+
+def bench_phase3(args: argparse.Namespace):
+    """Compares fill with the old Phase 3 on all data, timing both
+
+    Frames are partly removed and shuffled so that many are inserted. Fails
+    if the outputs differ anywhere."""
+    rng = random.Random(0)
+    inputs = []
+    for text in load_texts(data_files(args.data)):
+        for sentence in cusf.read(io.StringIO(text)):
+            frames = [f for f in sentence.frames if rng.random() < 0.5]
+            rng.shuffle(frames)
+            out = io.StringIO()
+            cusf.Sentence(sentence.syntax, 1).write(out)
+            for frame in frames:
+                blocks.write(frame.to_block(), out)
+            inputs.append(out.getvalue())
+    def run(cls):
+        best = float('inf')
+        for _ in range(args.repeat):
+            sentences = [
+                copy_sentence(s, cls)
+                for text in inputs
+                for s in cusf.read(io.StringIO(text))
+            ]
+            for sentence in sentences:
+                sentence.tree # not part of what we measure
+            start = time.perf_counter()
+            for sentence in sentences:
+                sentence.fill()
+            best = min(best, time.perf_counter() - start)
+        outputs = []
+        for sentence in sentences:
+            out = io.StringIO()
+            sentence.write(out)
+            outputs.append(out.getvalue())
+        return best, outputs
+    logging.disable(logging.WARNING)
+    old, old_outputs = run(CursorSentence)
+    new, new_outputs = run(cusf.Sentence)
+    logging.disable(logging.NOTSET)
+    for i, (o, n) in enumerate(zip(old_outputs, new_outputs)):
+        if o != n:
+            raise AssertionError(f'fill output differs for sentence {i}:\n{o}\n---\n{n}')
+    print(f'fill, {len(inputs)} sentences, outputs identical:')
+    report('phase 3 (cursor insertion)', old)
+    report('phase 3 (indexed merge)', new, old)
+
+
+def copy_sentence(sentence: cusf.Sentence, cls: type) -> cusf.Sentence:
+    s = cls(sentence.syntax, sentence.lineno)
+    s.frames = sentence.frames
+    s.frame_linenos = sentence.frame_linenos
+    return s
+
+
+def synthetic_corpus(path: str, sentence_count: int, source: str):
+    """Writes a file of sentence_count sentences, cycling through source"""
+    with open(source) as f:
+        texts = []
+        for sentence in cusf.read(f):
+            out = io.StringIO()
+            sentence.write(out)
+            texts.append(out.getvalue())
+    with open(path, 'w') as f:
+        for text in itertools.islice(itertools.cycle(texts), sentence_count):
+            f.write(text)
+
+
+def bench_memory(args: argparse.Namespace):
+    check_py = os.path.join(os.path.dirname(__file__), 'check.py')
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in args.sentences:
+            path = os.path.join(tmp, f'synthetic-{count}.cusf')
+            synthetic_corpus(path, count, args.synthetic_source)
+            start = time.perf_counter()
+            process = subprocess.Popen(
+                [sys.executable, check_py, '--no-cache', '--jobs', '1', path],
+                stderr=subprocess.DEVNULL,
+            )
+            _, status, rusage = os.wait4(process.pid, 0)
+            seconds = time.perf_counter() - start
+            if status != 0:
+                raise RuntimeError(f'check.py failed on {count} sentences')
+            # ru_maxrss is in kilobytes on Linux
+            print(f'check {count:>7} sentences  {seconds:8.1f} s  '
+                    f'peak RSS {rusage.ru_maxrss / 1024:8.1f} MB')
+
+
+def synthetic_sentence(token_count: int, rng: random.Random) -> str:
+    """A CoNLL-U sentence with a random tree, for stress tests"""
+    deprels = ('nsubj', 'obj', 'obl', 'advmod', 'amod', 'det', 'case', 'conj',
+            'advcl', 'nmod', 'acl', 'xcomp', 'punct', 'compound')
+    lines = [f'# sent_id = synthetic-{token_count}-{rng.randrange(10 ** 6)}',
+            '# text = ' + ' '.join(f'w{i}' for i in range(1, token_count + 1))]
+    for i in range(1, token_count + 1):
+        head = rng.randint(1, i - 1) if i > 1 else 0
+        deprel = rng.choice(deprels) if head else 'root'
+        lines.append(f'{i}\tw{i}\tw{i}\tX\t_\t_\t{head}\t{deprel}\t_\t_')
+    return '\n'.join(lines) + '\n\n'
+
+
+def label_randomly(text: str, rng: random.Random) -> str:
+    """Fills in a text and labels its frames at random, mostly validly"""
+    out = io.StringIO()
+    for sentence in cusf.read(io.StringIO(text)):
+        sentence.fill(diagnostics.ListCollector())
+        for frame in sentence.frames:
+            if not isinstance(frame, cusf.Frame):
+                continue
+            name = rng.choice(list(labels.FRAMES))
+            aspect = None
+            if isinstance(labels.FRAMES[name], labels.Flexible) \
+                    and rng.random() < 0.2:
+                aspect = rng.choice(labels.ASPECTS)
+            frame.label = name + (f'-{aspect}' if aspect else '')
+            core = sorted(labels.CORE_ROLES[name, aspect])
+            for arg in frame.args:
+                r = rng.random()
+                if r < 0.8:
+                    arg.label = rng.choice(core)
+                elif r < 0.95:
+                    arg.label = rng.choice('mx') + '-' + \
+                            rng.choice(sorted(labels.NONCORE_ROLES))
+                else:
+                    arg.label = 'unknown'
+        sentence.write(out)
+    return out.getvalue()
+
+
+def stage_inputs(args: argparse.Namespace) -> List[Tuple[str, List[str]]]:
+    """(name, labelled texts) for each data directory and synthetic sentence"""
+    rng = random.Random(0)
+    inputs = []
+    for name in sorted(os.listdir(args.data)):
+        files = data_files(os.path.join(args.data, name))
+        if files:
+            inputs.append((name, [label_randomly(t, rng)
+                    for t in load_texts(files)]))
+    for token_count in args.tokens:
+        text = ''.join(synthetic_sentence(token_count, rng)
+                for _ in range(SYNTHETIC_SENTENCES))
+        inputs.append((f'synthetic-{token_count}', [label_randomly(text, rng)]))
+    return inputs
+
+
+def timed(fn: Callable, *args) -> Tuple[object, float]:
+    """Calls fn, returning its result and the time it took
+
+    Garbage collection is off while timing, as with timeit."""
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        result = fn(*args)
+        return result, time.perf_counter() - start
+    finally:
+        gc.enable()
+
+
+def fill_all(sentences: List[cusf.Sentence]):
+    collector = diagnostics.ListCollector()
+    for sentence in sentences:
+        sentence.fill(collector)
+
+
+def check_all(sentences: List[cusf.Sentence]):
+    collector = diagnostics.ListCollector()
+    for sentence in sentences:
+        sentence.check(collector=collector)
+
+
+def write_all(sentences: List[cusf.Sentence]):
+    out = io.StringIO()
+    for sentence in sentences:
+        sentence.write(out)
+
+
+def check_label_pairs(pairs: List[Tuple[str, str]]):
+    for dep, frame in pairs:
+        labels.check_dep_label(dep, frame)
+
+
+def time_stages(text: str) -> Dict[str, float]:
+    """Times each stage of processing a text, each working on the last"""
+    times = {}
+    sentences, times['read'] = timed(lambda: list(cusf.read(io.StringIO(text))))
+    _, times['fill'] = timed(fill_all, sentences)
+    _, times['check'] = timed(check_all, sentences)
+    _, times['write'] = timed(write_all, sentences)
+    _, times['create_pred_edges_map'] = timed(agreement.create_pred_edges_map,
+            sentences, diagnostics.ListCollector())
+    labels.check_dep_label.cache_clear()
+    labels.parse_frame_label_part.cache_clear()
+    pairs = [(arg.label, frame.label)
+            for sentence in sentences
+            for frame in sentence.frames
+            if isinstance(frame, cusf.Frame) and frame.label
+            for arg in frame.args]
+    _, times['check_dep_label'] = timed(check_label_pairs, pairs)
+    return times
+
+
+def bench_stages(args: argparse.Namespace):
+    for name, texts in stage_inputs(args):
+        best: Dict[str, float] = {}
+        for _ in range(args.repeat):
+            totals: Dict[str, float] = {}
+            for text in texts:
+                for stage, seconds in time_stages(text).items():
+                    totals[stage] = totals.get(stage, 0.0) + seconds
+            for stage, seconds in totals.items():
+                best[stage] = min(best.get(stage, float('inf')), seconds)
+        sentence_count = sum(t.count('# sent_id') for t in texts)
+        print(f'{name}: {len(texts)} files, {sentence_count} sentences')
+        for stage, seconds in best.items():
+            report(f'{stage} {name}', seconds)
+
+
+def build_trees(sentences: List[cusf.Sentence]):
+    for sentence in sentences:
+        for syntax in sentence.syntax:
+            syntax.to_tree()
+
+
+def bench_syntax(args: argparse.Namespace):
+    """Compares the CoNLL-U parsers on the stages that depend on them, and
+    counts the sentences each does not write back as they were read"""
+    texts = load_texts(data_files(args.data))
+    sources = ['\n'.join(block) for text in texts
+            for block in blocks.read(io.StringIO(text))
+            if block and not cusf.is_frame_block(block)]
+    baselines: Dict[str, float] = {}
+    previous_backend = cusf.syntax_backend
+    try:
+        for backend in cusf.SYNTAX_BACKENDS:
+            cusf.syntax_backend = backend
+            best: Dict[str, float] = {}
+            for _ in range(args.repeat):
+                totals: Dict[str, float] = {}
+                for text in texts:
+                    times = {}
+                    sentences, times['read'] = timed(
+                            lambda: list(cusf.read(io.StringIO(text))))
+                    _, times['to_tree'] = timed(build_trees, sentences)
+                    _, times['check'] = timed(check_all, sentences)
+                    _, times['write'] = timed(write_all, sentences)
+                    for stage, seconds in times.items():
+                        totals[stage] = totals.get(stage, 0.0) + seconds
+                for stage, seconds in totals.items():
+                    best[stage] = min(best.get(stage, float('inf')), seconds)
+            for stage, seconds in best.items():
+                report(f'{stage} ({backend})', seconds, baselines.get(stage))
+                baselines.setdefault(stage, seconds)
+            changed = sum(cusf.load_syntax(source).conll() != source + '\n\n'
+                    for source in sources)
+            print(f'{backend}: {changed}/{len(sources)} sentences changed by a '
+                    'round trip')
+    finally:
+        cusf.syntax_backend = previous_backend
+
+
+def burst_blocks(name: str) -> int:
+    """The old burst: chunks of 50 blocks, regardless of sentences"""
+    base, ext = name.split('.', 1)
+    count = 0
+    out = None
+    with open(name) as f:
+        for i, block in enumerate(blocks.read(f)):
+            if i % 50 == 0:
+                if out:
+                    out.close()
+                out = open(f'{base}.{i // 50:02d}.{ext}', 'w')
+                count += 1
+            blocks.write(block, out)
+    if out:
+        out.close()
+    return count
+
+
+def chunk_stats(name: str, count: int) -> Tuple[float, int]:
+    """The relative standard deviation of the tokens per chunk, and the
+    number of chunks that start in the middle of a sentence"""
+    tokens = []
+    split = 0
+    for i in range(count):
+        with open(burst.chunk_name(name, i)) as f:
+            chunk_blocks = list(blocks.read(f))
+        tokens.append(sum(1 for block in chunk_blocks
+                if not cusf.is_frame_block(block)
+                for line in block if line and line[0] != '#'))
+        if chunk_blocks and cusf.is_frame_block(chunk_blocks[0]):
+            split += 1
+    return float(np.std(tokens) / np.mean(tokens)), split
+
+
+def bench_burst(args: argparse.Namespace):
+    """Compares splitting every 50 blocks with splitting at sentences into
+    chunks of balanced size, on all files of the directory of
+    --long-sentence"""
+    files = sorted(glob.glob(os.path.join(os.path.dirname(args.long_sentence),
+            '*.cusf')))
+    with tempfile.TemporaryDirectory() as tmp:
+        name = os.path.join(tmp, 'all.cusf')
+        with open(name, 'w') as out:
+            for text in load_texts(files):
+                out.write(text)
+        runs = (
+            ('50 blocks', lambda: burst_blocks(name)),
+            ('800 tokens, 1 writer', lambda: burst.burst(name, jobs=1)),
+            ('800 tokens, 4 writers', lambda: burst.burst(name, jobs=4)),
+        )
+        baseline = None
+        for label, run in runs:
+            for path in glob.glob(os.path.join(tmp, 'all.*.cusf')):
+                os.unlink(path)
+            seconds = best_of(args.repeat, run)
+            count = run()
+            spread, split = chunk_stats(name, count)
+            report(f'burst ({label})', seconds, baseline)
+            print(f'  {count} chunks, tokens per chunk vary by {spread:.0%}, '
+                    f'{split} start inside a sentence')
+            baseline = baseline or seconds
+        merged = best_of(args.repeat, lambda: burst.merge(name))
+        report('merge', merged)
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'system': platform.system(),
+    }
+
+
+def compare(baseline: dict, results: Dict[str, float], threshold: float) \
+        -> List[str]:
+    """Prints results next to baseline ones, returning names of regressions"""
+    old = baseline['results']
+    regressions = []
+    print(f'{"":<48} {"before":>10} {"after":>10}  change')
+    for name in sorted(set(old) | set(results)):
+        if name not in results or name not in old:
+            before = f'{old[name] * 1000:7.1f} ms' if name in old else ''
+            after = f'{results[name] * 1000:7.1f} ms' if name in results else ''
+            print(f'{name:<48} {before:>10} {after:>10}')
+            continue
+        change = results[name] / old[name] - 1
+        flag = ''
+        if change > threshold and results[name] - old[name] > NOISE:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f'{name:<48} {old[name] * 1000:7.1f} ms {results[name] * 1000:7.1f} ms'
+                f'  {change:+6.1%}{flag}')
+    return regressions
+
+
+BENCHMARKS = {
+    'read': bench_read,
+    'lazy': bench_lazy,
+    'sidecar': bench_sidecar,
+    'store': bench_store,
+    'lsp': bench_lsp,
+    'startup': bench_startup,
+    'stats': bench_stats,
+    'tree': bench_tree,
+    'memory': bench_memory,
+    'objects': bench_objects,
+    'phase3': bench_phase3,
+    'stages': bench_stages,
+    'syntax': bench_syntax,
+    'burst': bench_burst,
+}
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('benchmark', nargs='*',
+            help=f'benchmarks to run (default: all): {", ".join(BENCHMARKS)}')
+    arg_parser.add_argument('--data', default=DATA_DIR,
+            help='directory to search for .cusf files')
+    arg_parser.add_argument('--long-sentence',
+            default=os.path.join(DATA_DIR, '1984', 'de', '000.cusf'),
+            help='file whose first sentence micro-benchmarks use')
+    arg_parser.add_argument('--sentences', type=int, nargs='+',
+            default=[1000, 10000, 100000],
+            help='synthetic corpus sizes for the memory benchmark')
+    arg_parser.add_argument('--synthetic-source',
+            default=os.path.join(DATA_DIR, 'prince', 'prince.cusf'),
+            help='file whose sentences synthetic corpora repeat')
+    arg_parser.add_argument('--tokens', type=int, nargs='+',
+            default=[100, 300, 1000],
+            help='lengths of the synthetic sentences for the stages benchmark')
+    arg_parser.add_argument('--repeat', type=int, default=3)
+    arg_parser.add_argument('--number', type=int, default=20,
+            help='iterations per repeat for micro-benchmarks')
+    arg_parser.add_argument('--json', metavar='FILE',
+            help='write the results to FILE')
+    arg_parser.add_argument('--compare', metavar='FILE',
+            help='compare the results with those in FILE')
+    arg_parser.add_argument('--threshold', type=float, default=0.1,
+            help='slowdown that counts as a regression (default: %(default)s)')
+    args = arg_parser.parse_args()
+    for name in args.benchmark:
+        if name not in BENCHMARKS:
+            arg_parser.error(f'unknown benchmark: {name}')
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    for name in args.benchmark or BENCHMARKS:
+        start_benchmark(name)
+        BENCHMARKS[name](args)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'environment': environment(),
+                'repeat': args.repeat,
+                'number': args.number,
+                'results': RESULTS,
+            }, f, indent=2, sort_keys=True)
+            print(file=f)
+    if baseline is not None:
+        if baseline['environment'] != environment() | {
+                'commit': baseline['environment']['commit']}:
+            print(f'warning: baseline is from another environment: '
+                    f'{baseline["environment"]}', file=sys.stderr)
+        regressions = compare(baseline, RESULTS, args.threshold)
+        if regressions:
+            print(f'{len(regressions)} regression(s) beyond {args.threshold:.0%}',
+                    file=sys.stderr)
+            sys.exit(1)
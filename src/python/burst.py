@@ -1,31 +1,292 @@
 #!/usr/bin/env python3
 
 
-"""Split a text file into 50-block chunks."""
+"""Split a CUSF or CoNLL-U file into chunks, or merge chunks back.
 
+The chunks of NAME.EXT are NAME.00.EXT, NAME.01.EXT, and so on. Chunks end at
+sentence boundaries, so a sentence always stays together with its frames.
+Each chunk is filled with sentences up to --size tokens, predicates or
+sentences (see --by); a sentence bigger than that gets a chunk of its own.
+The input is streamed, and chunks are written in the background while the
+next ones are collected.
 
+This needs the input to be CUSF or CoNLL-U, where frames only come after the
+sentence they belong to. Other files of blocks separated by blank lines can
+be split with --by blocks, which counts blocks without looking at them, so
+chunks may start in the middle of a sentence's frames.
+
+With --merge, the chunks are concatenated back into NAME.EXT, checking that
+no sent_id occurs twice and that each sentence continues the numbering of the
+one before (increasing numbers for IDs like n01001011, consecutive ones for
+plain numbers). NAME.EXT is only replaced, keeping a backup, if the checks
+pass.
+"""
+
+
+import argparse
+import collections
+import concurrent.futures
+import glob
+import io
+import itertools
+import logging
+import os
+import re
+import shutil
 import sys
+import tempfile
+from typing import Dict, Iterable, List, Optional, TextIO, Tuple
 
 
 import blocks
+import conllu
+import cusf
 
 
-if __name__ == '__main__':
+MEASURES = ('tokens', 'predicates', 'sentences', 'blocks')
+DEFAULT_SIZES = {'blocks': 50} # 800 for the other measures
+NUMBERED_ID = re.compile(r'(.*?)(\d+)$')
+
+
+def split_name(name: str) -> Tuple[str, str]:
+    """Splits a path before the first dot of the file name"""
+    directory, filename = os.path.split(name)
+    base, ext = filename.split('.', 1)
+    return os.path.join(directory, base), ext
+
+
+def chunk_name(name: str, index: int) -> str:
+    base, ext = split_name(name)
+    return f'{base}.{index:02d}.{ext}'
+
+
+def chunk_files(name: str) -> Dict[int, str]:
+    """Finds the chunks of a file, by index"""
+    base, ext = split_name(name)
+    pattern = re.compile(re.escape(base) + r'\.(\d+)\.' + re.escape(ext) + '$')
+    found = {}
+    for path in glob.glob(f'{glob.escape(base)}.*.{glob.escape(ext)}'):
+        match = pattern.match(path)
+        if match:
+            found[int(match.group(1))] = path
+    return found
+
+
+def sentence_size(sentence: cusf.Sentence, measure: str) -> int:
+    """Counts the words, predicates (as fill sees them) or 1 for a sentence
+
+    Predicates of sentences without a valid tree are counted by frames."""
+    if measure == 'sentences':
+        return 1
+    if measure == 'tokens':
+        return sum(1 for syntax in sentence.syntax for token in syntax
+                if not token.is_multiword() and not token.is_empty_node())
     try:
-        _, name = sys.argv
-    except ValueError:
-        print('USAGE: python3 burst.py NAME', file=sys.stderr)
-        sys.exit(1)
-    base, ext = name.split('.', 1)
-    with open(name) as f:
-        blx = list(blocks.read(f))
-    for chunk, offset in enumerate(range(0, len(blx), 50)):
-        name = f'{base}.{chunk:02d}.{ext}'
-        with open(name, 'w') as f:
-            for block in blx[offset:offset + 50]:
-                blocks.write(block, f)
+        return sum(1 for tree in cusf.subtrees(sentence.tree)
+                if cusf.is_semantic_predicate(tree))
+    except (IndexError, ValueError):
+        return len(sentence.frames)
+
+
+def chunks(sentences: Iterable[cusf.Sentence], measure: str, size: int) \
+        -> Iterable[List[cusf.Sentence]]:
+    chunk: List[cusf.Sentence] = []
+    chunk_size = 0
+    for sentence in sentences:
+        n = sentence_size(sentence, measure)
+        if chunk and chunk_size + n > size:
+            yield chunk
+            chunk = []
+            chunk_size = 0
+        chunk.append(sentence)
+        chunk_size += n
+    if chunk:
+        yield chunk
+
+
+def block_chunks(f: TextIO, size: int) -> Iterable[List[blocks.Block]]:
+    """Cuts a file into runs of size blocks, whatever the blocks are"""
+    block_iterator = blocks.read(f)
+    while True:
+        chunk = list(itertools.islice(block_iterator, size))
+        if not chunk:
+            return
+        yield chunk
 
 
+def write_blocks(path: str, chunk: List[blocks.Block]):
+    out = io.StringIO()
+    for block in chunk:
+        blocks.write(block, out)
+    with open(path, 'w') as f:
+        f.write(out.getvalue())
 
 
+def write_chunk(path: str, sentences: List[cusf.Sentence]):
+    out = io.StringIO()
+    for sentence in sentences:
+        if not sentence.syntax:
+            out.write('\n') # an empty block, which Sentence.write leaves out
+        sentence.write(out)
+    with open(path, 'w') as f:
+        f.write(out.getvalue())
 
+
+def burst(name: str, measure: str='tokens', size: int=800, jobs: int=4) \
+        -> int:
+    """Splits a file into chunks, returning how many there are
+
+    Sentences are read with the native CoNLL-U parser, which writes them back
+    exactly as they were; cusf.read raises ValueError if the file is not
+    CUSF. With the measure blocks, the file is not parsed at all. At most
+    jobs chunks are waiting to be written at any time."""
+    backend = cusf.syntax_backend
+    cusf.syntax_backend = 'native'
+    try:
+        with open(name) as f, \
+                concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+            pending: collections.deque = collections.deque()
+            count = 0
+            if measure == 'blocks':
+                parts, write = block_chunks(f, size), write_blocks
+            else:
+                parts = chunks(cusf.read(f, lazy=True), measure, size)
+                write = write_chunk
+            for chunk in parts:
+                if len(pending) >= jobs:
+                    pending.popleft().result()
+                pending.append(executor.submit(write, chunk_name(name, count),
+                        chunk))
+                count += 1
+            for future in pending:
+                future.result()
+    finally:
+        cusf.syntax_backend = backend
+    if os.path.exists(chunk_name(name, count)):
+        logging.warning('%s and any later chunks are left over from before',
+                chunk_name(name, count))
+    return count
+
+
+def sent_id(block: blocks.Block) -> Optional[str]:
+    for line in block:
+        match = conllu.KEY_VALUE_COMMENT.match(line.strip())
+        if match and match.group(1) == 'sent_id':
+            return match.group(2)
+    return None
+
+
+def follows(previous: str, current: str) -> bool:
+    """Tells whether a sent_id can come right after another one
+
+    IDs that are not numbered alike, such as n01001011 and w01001011, are
+    not compared."""
+    p = NUMBERED_ID.match(previous)
+    c = NUMBERED_ID.match(current)
+    if not p or not c or p.group(1) != c.group(1):
+        return True
+    if not p.group(1):
+        return int(c.group(2)) == int(p.group(2)) + 1
+    return int(c.group(2)) > int(p.group(2))
+
+
+def ranges(numbers: List[int]) -> Iterable[Tuple[int, int]]:
+    """Groups sorted numbers into (first, last) runs of consecutive ones"""
+    for _, group in itertools.groupby(enumerate(numbers),
+            lambda pair: pair[1] - pair[0]):
+        run = [n for _, n in group]
+        yield run[0], run[-1]
+
+
+def merge(name: str) -> bool:
+    """Concatenates the chunks of a file into it, if they pass the checks
+
+    Problems are logged. Returns whether the file was written."""
+    found = chunk_files(name)
+    if not found:
+        logging.error('no chunks of %s found', name)
+        return False
+    ok = True
+    missing = [i for i in range(max(found)) if i not in found]
+    for first, last in ranges(missing):
+        if first == last:
+            logging.error('chunk %s is missing', chunk_name(name, first))
+        else:
+            logging.error('chunks %s to %s are missing',
+                    chunk_name(name, first), chunk_name(name, last))
+        ok = False
+    seen: Dict[str, str] = {} # sent_id -> where it was
+    previous = None
+    with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(name) or '.',
+            delete=False) as out:
+        try:
+            for index in sorted(found):
+                lineno = 1
+                with open(found[index]) as f:
+                    for block in blocks.read(f):
+                        current = sent_id(block) \
+                                if not cusf.is_frame_block(block) else None
+                        if current is not None:
+                            location = f'{found[index]}:{lineno}'
+                            if current in seen:
+                                logging.error('%s: sent_id %s already occurs '
+                                        'at %s', location, current,
+                                        seen[current])
+                                ok = False
+                            elif previous is not None \
+                                    and not follows(previous, current):
+                                logging.error('%s: sent_id %s does not follow '
+                                        '%s', location, current, previous)
+                                ok = False
+                            seen.setdefault(current, location)
+                            previous = current
+                        blocks.write(block, out)
+                        lineno += len(block) + 1
+        except BaseException:
+            os.unlink(out.name)
+            raise
+    if not ok:
+        os.unlink(out.name)
+        return False
+    if os.path.exists(name):
+        shutil.copyfile(name, name + '~')
+        shutil.copymode(name, out.name)
+    os.replace(out.name, name)
+    return True
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        format='%(levelname)s %(message)s',
+        level=logging.INFO,
+    )
+    arg_parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--by', choices=MEASURES, default='tokens',
+            help='what to count to decide how big chunks are; all but blocks '
+            'need CUSF input (default: %(default)s)')
+    arg_parser.add_argument('--size', type=int,
+            help='maximum size of a chunk, unless a single sentence is '
+            'bigger (default: 800, which is about 50 sentences, or 50 with '
+            '--by blocks)')
+    arg_parser.add_argument('--jobs', '-j', type=int, default=4,
+            help='number of chunks to write at the same time (default: %(default)s)')
+    arg_parser.add_argument('--merge', action='store_true',
+            help='merge the chunks of NAME back into NAME')
+    arg_parser.add_argument('name', metavar='NAME')
+    args = arg_parser.parse_args()
+    if '.' not in os.path.basename(args.name):
+        arg_parser.error('NAME needs an extension, e.g. .cusf')
+    if args.merge:
+        if not merge(args.name):
+            sys.exit(1)
+    else:
+        try:
+            count = burst(args.name, args.by,
+                    args.size or DEFAULT_SIZES.get(args.by, 800),
+                    max(1, args.jobs))
+        except ValueError as e:
+            logging.error('cannot burst %s: %s (--by blocks splits files that '
+                    'are not CUSF)', args.name, e)
+            sys.exit(1)
+        logging.info('wrote %s chunks', count)
@@ -0,0 +1,158 @@
+"""Persistent cache for per-sentence fill and check results
+
+Results are stored in an SQLite file keyed by a hash of the sentence (with
+its frames) together with the source of cusf.py, conllu.py, diagnostics.py and
+labels.py and the CoNLL-U parser in use, so changes to the checking code
+invalidate them automatically. The cache is
+bounded in size and evicts the least recently used entries. It holds nothing
+that cannot be recomputed, so deleting the file is always safe.
+
+Several processes can share the file: it is in WAL mode, and every write is
+committed at once, so no process holds the write lock while it works on a
+sentence. When entries were last used is recorded in batches, with the next
+write.
+"""
+
+
+import collections
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import List, Optional, Tuple, Union
+
+
+import conllu
+import cusf
+import diagnostics
+import labels
+
+
+CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+    'superframes',
+)
+DEFAULT_PATH = os.path.join(CACHE_DIR, 'check.sqlite3')
+DEFAULT_MAX_SIZE = 100 * 1024 * 1024
+DEFAULT_MAX_ENTRIES = 100000 # for MemoryCache
+
+
+def code_version() -> str:
+    """Hashes the source of the modules that results depend on, and the
+    CoNLL-U parser, which decides how sentences are written"""
+    h = hashlib.sha256(cusf.syntax_backend.encode())
+    for module in (conllu, cusf, diagnostics, labels):
+        with open(module.__file__, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+class ResultCache:
+
+    def __init__(self, path: str=DEFAULT_PATH, max_size: int=DEFAULT_MAX_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.version = code_version()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('PRAGMA synchronous = NORMAL') # no fsync per commit
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                used REAL NOT NULL
+            )
+        ''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+        self.db.commit()
+        self.used: List[Tuple[float, str]] = [] # not yet recorded
+
+    def key(self, kind: str, *parts: object) -> str:
+        h = hashlib.sha256()
+        h.update(self.version.encode())
+        h.update(kind.encode())
+        for part in parts:
+            h.update(b'\0')
+            h.update(str(part).encode())
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[object]:
+        row = self.db.execute('SELECT value FROM results WHERE key = ?',
+                (key,)).fetchone()
+        if row is None:
+            return None
+        self.used.append((time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key: str, value: object):
+        value = json.dumps(value)
+        self.db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                (key, value, len(value), time.time()))
+        self.record_used()
+        self.db.commit()
+
+    def record_used(self):
+        self.db.executemany('UPDATE results SET used = ? WHERE key = ?',
+                self.used)
+        self.used = []
+
+    def evict(self):
+        """Drops least recently used entries until the cache fits max_size"""
+        total, = self.db.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM results').fetchone()
+        excess = total - self.max_size
+        if excess <= 0:
+            return
+        doomed = []
+        for key, size in self.db.execute(
+                'SELECT key, size FROM results ORDER BY used'):
+            if excess <= 0:
+                break
+            doomed.append((key,))
+            excess -= size
+        self.db.executemany('DELETE FROM results WHERE key = ?', doomed)
+
+    def close(self):
+        self.record_used()
+        self.evict()
+        self.db.commit()
+        self.db.close()
+
+
+class MemoryCache:
+    """A ResultCache kept in memory, for long-running processes
+
+    It evicts the least recently used entries beyond max_entries."""
+
+    def __init__(self, max_entries: int=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.results: collections.OrderedDict = collections.OrderedDict()
+
+    def key(self, kind: str, *parts: object) -> str:
+        h = hashlib.sha256()
+        h.update(kind.encode())
+        for part in parts:
+            h.update(b'\0')
+            h.update(str(part).encode())
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[object]:
+        if key not in self.results:
+            return None
+        self.results.move_to_end(key)
+        return self.results[key]
+
+    def put(self, key: str, value: object):
+        self.results[key] = value
+        self.results.move_to_end(key)
+        while len(self.results) > self.max_entries:
+            self.results.popitem(last=False)
+
+    def close(self):
+        pass
+
+
+Cache = Union[ResultCache, MemoryCache]
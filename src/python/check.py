@@ -2,17 +2,335 @@
 
 
 """
-Lints and checks a CUSF file.
+Lints and checks CUSF files.
+
+Each argument can be a file, a directory (searched recursively for .cusf
+files) or a glob pattern. Files are filled in and checked in parallel; the
+report lists them in sorted order. Results for sentences that have not
+changed since the last run are taken from a cache. Problems are logged, or
+with --format written as JSON lines or counted in a table by kind. With
+--profile, a report of where the time went follows each file.
+
+With --watch, keeps running and checks each file again whenever it is saved,
+keeping parsed sentences in memory so that only changes are processed. Watch
+mode reports problems as log messages or JSON lines; options for the cache,
+parallelism, summaries and profiles do not apply to it.
 """
 
 
 import argparse
+import concurrent.futures
+import contextlib
+import hashlib
+import io
+import json
 import logging
+import os
 import shutil
+import sys
+import sqlite3
 import tempfile
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
 
 
+import blocks
+import cache
+import corpus
 import cusf
+import diagnostics
+import profiling
+
+
+SyntaxCache = Dict[str, Optional['cusf.PyCoNLLSentence']]
+
+
+class FileReport(NamedTuple):
+    file: str
+    predicates: int
+    annotated: int
+    diagnostics: List[diagnostics.Diagnostic]
+    profile: Optional[profiling.Profile] = None
+
+    @property
+    def warnings(self) -> List[str]:
+        return [str(d) for d in self.diagnostics if d.level >= logging.WARNING]
+
+
+def fill_sentence(sentence: cusf.Sentence, lineno: int,
+        result_cache: Optional[cache.Cache]=None,
+        collector: diagnostics.Collector=diagnostics.LOG) \
+        -> Tuple[str, Optional[cusf.Sentence]]:
+    """Adds missing frames to a sentence that will start at line lineno
+
+    Returns the filled sentence as text, and the sentence itself, renumbered,
+    unless the text came from the cache."""
+    def fill(collector):
+        sentence.fill(collector)
+        f = io.StringIO()
+        sentence.write(f, lineno)
+        return f.getvalue()
+    if result_cache is None:
+        return fill(collector), sentence
+    # Diagnostics carry line numbers, so a moved sentence is filled again
+    key = result_cache.key('fill', sentence.lineno,
+            sentence.source_hash.hexdigest())
+    result = result_cache.get(key)
+    if result is None:
+        found = diagnostics.ListCollector()
+        text = fill(found)
+        result_cache.put(key, (text, found.diagnostics))
+        collector.extend(found.diagnostics)
+        return text, sentence
+    text, rows = result
+    collector.extend(rows)
+    return text, None
+
+
+def check_sentence(text: str, lineno: int,
+        filled: Optional[cusf.Sentence]=None, warn_incomplete: bool=True,
+        result_cache: Optional[cache.Cache]=None,
+        syntax_cache: Optional[SyntaxCache]=None,
+        collector: diagnostics.Collector=diagnostics.LOG) -> Tuple[int, int]:
+    """Checks a filled sentence, given as text starting at line lineno
+
+    If the filled sentence object is given, it is checked directly rather
+    than parsed from the text. Returns the number of predicates and the
+    number of annotated ones."""
+    def check(collector):
+        if filled is None:
+            sentences = cusf.read(io.StringIO(text), lineno,
+                    syntax_cache=syntax_cache)
+        else:
+            sentences = [filled]
+        predicate_count = 0
+        annotated_count = 0
+        for sentence in sentences:
+            p, a, w = sentence.check(collector=collector)
+            if warn_incomplete and a > 0 and a < p and w == 0:
+                collector.add(diagnostics.Diagnostic(logging.WARNING,
+                        'incomplete-sentence', sentence.syntax[0].id,
+                        sentence.lineno, None))
+            predicate_count += p
+            annotated_count += a
+        return predicate_count, annotated_count
+    if result_cache is None:
+        return check(collector)
+    key = result_cache.key('check', warn_incomplete, lineno, text)
+    result = result_cache.get(key)
+    if result is None:
+        found = diagnostics.ListCollector()
+        counts = check(found)
+        result = counts, found.diagnostics
+        result_cache.put(key, result)
+    (predicate_count, annotated_count), rows = result
+    collector.extend(rows)
+    return predicate_count, annotated_count
+
+
+def hashing(lines: Iterable[str], h: 'hashlib._Hash') -> Iterable[str]:
+    for line in lines:
+        h.update(line.encode())
+        yield line
+
+
+def check_file(path: str, warn_incomplete: bool=True,
+        result_cache: Optional[cache.Cache]=None,
+        syntax_cache: Optional[SyntaxCache]=None,
+        collector: diagnostics.Collector=diagnostics.LOG) -> Tuple[int, int]:
+    """Fills in and checks a file, one sentence at a time
+
+    The filled sentences are streamed to a temporary file, which replaces
+    the original (atomically, keeping a backup) only if anything changed.
+    Warnings from filling are emitted before those from checking. See
+    cusf.read for syntax_cache."""
+    original_hash = hashlib.sha256()
+    filled_hash = hashlib.sha256()
+    fill_found = diagnostics.ListCollector()
+    check_found = diagnostics.ListCollector()
+    predicate_count = 0
+    annotated_count = 0
+    lineno = 1
+    with open(path) as f, tempfile.NamedTemporaryFile('w',
+            dir=os.path.dirname(path) or '.', delete=False) as out:
+        try:
+            for sentence in cusf.read(hashing(f, original_hash),
+                    syntax_cache=syntax_cache):
+                # Add missing frames
+                text, sentence = fill_sentence(sentence, lineno,
+                        result_cache, fill_found)
+                out.write(text)
+                filled_hash.update(text.encode())
+                # Run checks
+                p, a = check_sentence(text, lineno, sentence,
+                        warn_incomplete, result_cache, syntax_cache,
+                        check_found)
+                predicate_count += p
+                annotated_count += a
+                lineno += text.count('\n')
+        except BaseException:
+            os.unlink(out.name)
+            raise
+    collector.extend(fill_found.diagnostics)
+    collector.extend(check_found.diagnostics)
+    # Replace file if anything changed
+    if filled_hash.digest() == original_hash.digest():
+        os.unlink(out.name)
+    else:
+        shutil.copyfile(path, path + '~')
+        shutil.copymode(path, out.name)
+        os.replace(out.name, path)
+    return predicate_count, annotated_count
+
+
+def open_cache(cache_path: Optional[str], cache_size: int,
+        collector: diagnostics.Collector=diagnostics.LOG) \
+        -> Optional[cache.ResultCache]:
+    if cache_path is None:
+        return None
+    try:
+        return cache.ResultCache(cache_path, cache_size)
+    except sqlite3.Error as e:
+        collector.add(diagnostics.Diagnostic(logging.WARNING,
+                'cannot-use-cache', None, None, None, (cache_path, str(e))))
+        return None
+
+
+def init_worker(level: int, syntax_backend: str):
+    logging.getLogger().handlers.clear()
+    logging.getLogger().setLevel(level)
+    cusf.syntax_backend = syntax_backend
+
+
+def report_file(path: str, warn_incomplete: bool=True,
+        cache_path: Optional[str]=None,
+        cache_size: int=cache.DEFAULT_MAX_SIZE,
+        profile: bool=False) -> FileReport:
+    """Checks a file, collecting its diagnostics instead of logging them
+
+    If profile is true, the report includes a profile of filling and
+    checking."""
+    found = diagnostics.ListCollector()
+    result_cache = open_cache(cache_path, cache_size, found)
+    with contextlib.ExitStack() as stack:
+        file_profile = stack.enter_context(profiling.enabled()) \
+                if profile else None
+        try:
+            predicates, annotated = check_file(path, warn_incomplete,
+                    result_cache, collector=found)
+        except Exception as e:
+            found.add(diagnostics.Diagnostic(logging.ERROR,
+                    'cannot-check-file', None, None, None, (str(e),)))
+            predicates, annotated = 0, 0
+        finally:
+            if result_cache is not None:
+                result_cache.close()
+    return FileReport(path, predicates, annotated, found.diagnostics,
+            file_profile)
+
+
+def check_files(files: List[str], warn_incomplete: bool=True, jobs: int=1,
+        cache_path: Optional[str]=None,
+        cache_size: int=cache.DEFAULT_MAX_SIZE,
+        profile: bool=False) -> Iterable[FileReport]:
+    """Checks files in parallel, yielding reports in the order of files"""
+    if jobs == 1 or len(files) == 1:
+        for path in files:
+            yield report_file(path, warn_incomplete, cache_path, cache_size,
+                    profile)
+        return
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=init_worker,
+        initargs=(logging.getLogger().level, cusf.syntax_backend),
+    ) as executor:
+        yield from executor.map(
+            report_file,
+            files,
+            [warn_incomplete] * len(files),
+            [cache_path] * len(files),
+            [cache_size] * len(files),
+            [profile] * len(files),
+        )
+
+
+def watch(paths: List[str], warn_incomplete: bool=True, interval: float=0.1,
+        report_format: str='log'):
+    """Checks files again whenever they change, until interrupted
+
+    Problems are reported as log messages or, if report_format is jsonl, as
+    JSON lines on standard output.
+
+    Parsed blocks and per-sentence results are kept in memory, so after a
+    change only the changed sentences are parsed, filled and checked again
+    (and those whose line numbers changed, checked again). A file is only
+    checked once it has stayed the same for one interval, so that we do not
+    fill in a file that is still being written."""
+    result_cache = cache.MemoryCache()
+    syntax_caches: Dict[str, SyntaxCache] = {}
+    checked: Dict[str, Tuple[int, int]] = {} # path -> (mtime, size)
+    pending: Dict[str, Tuple[int, int]] = {}
+    while True:
+        files = corpus.find_files(paths)
+        for path in set(syntax_caches) - set(files):
+            del syntax_caches[path]
+            checked.pop(path, None)
+        for path in files:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            stamp = stat.st_mtime_ns, stat.st_size
+            if checked.get(path) == stamp:
+                continue
+            if pending.get(path) != stamp:
+                pending[path] = stamp
+                continue
+            del pending[path]
+            start = time.perf_counter()
+            syntax_cache = syntax_caches.setdefault(path, {})
+            logging.info('checking %s', path)
+            found = diagnostics.ListCollector()
+            try:
+                predicates, annotated = check_file(path, warn_incomplete,
+                        result_cache, syntax_cache, found)
+                # Forget blocks that are gone, including our own rewrite
+                stat = os.stat(path)
+                with open(path) as f:
+                    current = set('\n'.join(b) for b in blocks.read(f))
+                for source in set(syntax_cache) - current:
+                    del syntax_cache[source]
+            except Exception as e:
+                found.add(diagnostics.Diagnostic(logging.ERROR,
+                        'cannot-check-file', None, None, None, (str(e),)))
+                predicates, annotated = 0, 0
+            if report_format == 'jsonl':
+                diagnostics.render_jsonl(found.diagnostics, path,
+                        level=logging.getLogger().getEffectiveLevel())
+                sys.stdout.flush()
+            else:
+                diagnostics.render_log(found.diagnostics)
+            checked[path] = stat.st_mtime_ns, stat.st_size
+            logging.info('%s: %s/%s predicates annotated (%.0f ms)', path,
+                    annotated, predicates, (time.perf_counter() - start) * 1000)
+        time.sleep(interval)
+
+
+def summary(reports: List[FileReport]) -> dict:
+    return {
+        'files': [
+            {
+                'file': r.file,
+                'predicates': r.predicates,
+                'annotated': r.annotated,
+                'warnings': r.warnings,
+            }
+            for r in reports
+        ],
+        'predicates': sum(r.predicates for r in reports),
+        'annotated': sum(r.annotated for r in reports),
+        'warnings': sum(len(r.warnings) for r in reports),
+    }
 
 
 if __name__ == '__main__':
@@ -21,40 +339,99 @@ if __name__ == '__main__':
         format='%(levelname)s %(message)s',
         level=logging.INFO,
     )
-    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
     arg_parser.add_argument('--warn-incomplete',
             action=argparse.BooleanOptionalAction, default=True)
     arg_parser.add_argument('--debug',
             action=argparse.BooleanOptionalAction, default=False)
-    arg_parser.add_argument('file')
+    arg_parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count(),
+            help='number of files to check in parallel (default: number of CPUs)')
+    arg_parser.add_argument('--format', choices=('log', 'jsonl', 'table'),
+            default='log', help='report problems as log messages (default), '
+            'as JSON lines on standard output, or as a table of how often '
+            'each kind of problem occurs')
+    arg_parser.add_argument('--summary', metavar='FILE',
+            help='write a JSON summary to FILE (- for standard output)')
+    arg_parser.add_argument('--cache', metavar='FILE', default=cache.DEFAULT_PATH,
+            help=f'result cache file, safe to delete (default: {cache.DEFAULT_PATH})')
+    arg_parser.add_argument('--no-cache', dest='cache', action='store_const',
+            const=None, help='do not use the result cache')
+    arg_parser.add_argument('--cache-size', metavar='MB', type=int,
+            default=cache.DEFAULT_MAX_SIZE // (1024 * 1024),
+            help='maximum size of the result cache in megabytes (default: %(default)s)')
+    arg_parser.add_argument('--profile', action='store_true',
+            help='report where filling and checking spend their time in each '
+            'file (implies --no-cache)')
+    arg_parser.add_argument('--syntax', choices=cusf.SYNTAX_BACKENDS,
+            default=cusf.syntax_backend, help='CoNLL-U parser: pyconll '
+            '(default) or the lighter one in conllu.py, which writes '
+            'sentences back exactly as they were read')
+    arg_parser.add_argument('--watch', action='store_true',
+            help='keep running, checking files again whenever they change')
+    arg_parser.add_argument('--interval', metavar='SECONDS', type=float,
+            default=0.1, help='how often --watch looks for changes (default: %(default)s)')
+    arg_parser.add_argument('path', nargs='+')
     args = arg_parser.parse_args()
+    cusf.syntax_backend = args.syntax
     # Set log level
     if args.debug:
         logging.getLogger().setLevel(logging.DEBUG)
-    # Make backup file
-    backup_file = args.file + '~'
-    shutil.copyfile(args.file, backup_file)
-    # Read file
-    with open(args.file) as f:
-        sentences = [s for s in cusf.read(f)]
-    # Add missing frames
-    with tempfile.NamedTemporaryFile('w', delete=False) as f:
-        for sentence in sentences:
-            sentence.fill()
-            sentence.write(f)
-        f.close()
-        shutil.move(f.name, args.file)
-    # Read file again
-    with open(args.file) as f:
-        sentences = [s for s in cusf.read(f)]
-    # Run checks and emit warnings
-    predicate_count = 0
-    annotated_count = 0
-    for sentence in sentences:
-        p, a, w = sentence.check()
-        if args.warn_incomplete and a > 0 and a < p and w == 0:
-            logging.warning('sent %s line %s annotation of sentence not complete',
-                    sentence.syntax[0].id, sentence.lineno)
-        predicate_count += p
-        annotated_count += a
-    logging.info('%s/%s predicates annotated', annotated_count, predicate_count)
+    files = corpus.find_files(args.path)
+    if not files:
+        arg_parser.error('no .cusf files found')
+    # Watch mode
+    if args.watch:
+        for option, dest in (('--jobs', 'jobs'), ('--summary', 'summary'),
+                ('--cache/--no-cache', 'cache'), ('--cache-size', 'cache_size'),
+                ('--profile', 'profile')):
+            if getattr(args, dest) != arg_parser.get_default(dest):
+                arg_parser.error(f'{option} cannot be used with --watch')
+        if args.format == 'table':
+            arg_parser.error('--format table cannot be used with --watch')
+        try:
+            watch(args.path, args.warn_incomplete, args.interval, args.format)
+        except KeyboardInterrupt:
+            pass
+        sys.exit()
+    # Check files, reporting each one in order as soon as it is done
+    level = logging.getLogger().getEffectiveLevel()
+    reports = []
+    if args.profile:
+        args.cache = None
+    for report in check_files(files, args.warn_incomplete, max(1, args.jobs),
+            args.cache, args.cache_size * 1024 * 1024, args.profile):
+        if len(files) > 1:
+            logging.info('checking %s', report.file)
+        if args.format == 'log':
+            diagnostics.render_log(report.diagnostics)
+        elif args.format == 'jsonl':
+            diagnostics.render_jsonl(report.diagnostics, report.file,
+                    level=level)
+        if len(files) > 1:
+            logging.info('%s: %s/%s predicates annotated', report.file,
+                    report.annotated, report.predicates)
+        if report.profile is not None:
+            logging.info('profile of %s:', report.file)
+            for row in profiling.report(report.profile):
+                logging.info('%s', row)
+        reports.append(report)
+    logging.info('%s/%s predicates annotated',
+            sum(r.annotated for r in reports),
+            sum(r.predicates for r in reports))
+    if args.profile and len(reports) > 1:
+        logging.info('profile of all files:')
+        for row in profiling.report(profiling.merge([r.profile
+                for r in reports if r.profile is not None])):
+            logging.info('%s', row)
+    if args.format == 'table':
+        diagnostics.render_table(((r.file, d) for r in reports
+                for d in r.diagnostics), level=level)
+    # Write summary
+    if args.summary == '-':
+        json.dump(summary(reports), sys.stdout, indent=2)
+        print()
+    elif args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump(summary(reports), f, indent=2)
+            print(file=f)
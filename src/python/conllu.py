@@ -0,0 +1,342 @@
+"""A lightweight CoNLL-U model, as an alternative to pyconll
+
+cusf only looks at a few columns of each token and at the dependency tree,
+but pyconll parses every column of every token into objects when loading.
+Here, a sentence keeps its lines and the ten columns of its tokens as
+parallel lists. Tokens are views into these lists, FEATS, DEPS and MISC are
+only parsed when accessed, and serializing a sentence gives back its lines
+unchanged. The classes have the parts of pyconll's interface that this
+package uses, so cusf can run on either (see cusf.SYNTAX_BACKENDS).
+
+Columns are read as pyconll reads them, except that malformed FEATS, DEPS
+or MISC values only raise ParseError when they are accessed.
+"""
+
+
+import re
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple, \
+        Union
+
+
+EMPTY = '_'
+KEY_VALUE_COMMENT = re.compile(r'#\s*([^=]+?)\s*=\s*(.+)')
+SINGLETON_COMMENT = re.compile(r'#\s*(\S.*?)\s*$')
+
+
+class ParseError(ValueError):
+    pass
+
+
+def unit(value: str) -> Optional[str]:
+    return None if value == EMPTY else value
+
+
+def parse_dict(column: str, separator: str,
+        parse_value: Callable[[Optional[str]], object]) -> dict:
+    """Parses a FEATS, DEPS or MISC column into a dict, like pyconll"""
+    if column == EMPTY:
+        return {}
+    result = {}
+    for component in column.split('|'):
+        parts = component.split(separator, 1)
+        value = parts[1] if len(parts) == 2 and parts[1] else None
+        result[parts[0]] = parse_value(value)
+    return result
+
+
+def parse_feats_value(value: Optional[str]) -> Set[str]:
+    if value is None:
+        raise ParseError(f'Error parsing "{value}" properly. Please check '
+                'against CoNLL format spec.')
+    return set(value.split(','))
+
+
+def parse_deps_value(value: Optional[str]) -> Tuple[Optional[str], ...]:
+    components = [] if value is None else value.split(':')
+    if not 0 < len(components) <= 4:
+        raise ParseError(f'Error parsing "{value}" as tuple properly. Please '
+                'check against CoNLL format spec.')
+    return tuple(components + [None] * (4 - len(components)))
+
+
+def parse_misc_value(value: Optional[str]) -> Optional[Set[str]]:
+    return None if value is None else set(value.split(','))
+
+
+class Token:
+    """A view of one token of a sentence"""
+
+    __slots__ = ('sentence', 'index', '_feats', '_deps', '_misc')
+
+    def __init__(self, sentence: 'Sentence', index: int):
+        self.sentence = sentence
+        self.index = index
+        self._feats = None
+        self._deps = None
+        self._misc = None
+
+    @property
+    def id(self) -> str:
+        return self.sentence.ids[self.index]
+
+    @property
+    def form(self) -> Optional[str]:
+        return self.sentence.forms[self.index]
+
+    @property
+    def lemma(self) -> Optional[str]:
+        return self.sentence.lemmas[self.index]
+
+    @property
+    def upos(self) -> Optional[str]:
+        return self.sentence.upos[self.index]
+
+    @property
+    def xpos(self) -> Optional[str]:
+        return self.sentence.xpos[self.index]
+
+    @property
+    def head(self) -> Optional[str]:
+        return self.sentence.heads[self.index]
+
+    @property
+    def deprel(self) -> Optional[str]:
+        return self.sentence.deprels[self.index]
+
+    @property
+    def feats(self) -> Dict[str, Set[str]]:
+        if self._feats is None:
+            self._feats = parse_dict(self.sentence.feats[self.index], '=',
+                    parse_feats_value)
+        return self._feats
+
+    @property
+    def deps(self) -> Dict[str, Tuple[Optional[str], ...]]:
+        if self._deps is None:
+            self._deps = parse_dict(self.sentence.deps[self.index], ':',
+                    parse_deps_value)
+        return self._deps
+
+    @property
+    def misc(self) -> Dict[str, Optional[Set[str]]]:
+        if self._misc is None:
+            self._misc = parse_dict(self.sentence.misc[self.index], '=',
+                    parse_misc_value)
+        return self._misc
+
+    def is_multiword(self) -> bool:
+        return '-' in self.id
+
+    def is_empty_node(self) -> bool:
+        return '.' in self.id
+
+    def conll(self) -> str:
+        return self.sentence.token_lines[self.index]
+
+
+class Tree:
+    """A node of a dependency tree; iterating over it gives its children"""
+
+    __slots__ = ('data', 'parent', 'children')
+
+    def __init__(self, data: Token, parent: Optional['Tree']):
+        self.data = data
+        self.parent = parent
+        self.children: List[Tree] = []
+
+    def __iter__(self) -> Iterator['Tree']:
+        return iter(self.children)
+
+    def __len__(self) -> int:
+        return len(self.children)
+
+    def __getitem__(self, key: int) -> 'Tree':
+        return self.children[key]
+
+
+class Sentence:
+    """A sentence, with the columns of its tokens as parallel lists
+
+    Empty values (_) are None, as in pyconll, except in FEATS, DEPS and MISC,
+    which are kept as they are until parsed by Token."""
+
+    __slots__ = ('_lines', 'comments', '_token_lines', 'ids', 'forms',
+            'lemmas', 'upos', 'xpos', 'feats', 'heads', 'deprels', 'deps',
+            'misc', '_meta', '_tokens', '_indexes')
+
+    def __init__(self, lines: List[str]):
+        comments = []
+        token_lines = []
+        rows = []
+        for line in lines:
+            stripped = line.strip()
+            if stripped[0] == '#':
+                comments.append(stripped)
+                continue
+            fields = stripped.split('\t')
+            if len(fields) != 10:
+                raise ParseError('The number of columns per token line must '
+                        f'be 10. Invalid token: {stripped}')
+            token_lines.append(line)
+            rows.append(fields)
+        self.set_columns(comments,
+                list(map(list, zip(*rows))) if rows else [[]] * 10)
+        self._lines: Optional[List[str]] = lines
+        self._token_lines: Optional[List[str]] = token_lines
+
+    @classmethod
+    def from_columns(cls, comments: List[str], columns: List[List[str]]) \
+            -> 'Sentence':
+        """Makes a sentence from its comments and the ten columns of its
+        tokens, as they are written, without parsing any lines
+
+        Its lines are the comments followed by the tokens."""
+        sentence = cls.__new__(cls)
+        sentence.set_columns(comments, columns)
+        sentence._lines = None
+        sentence._token_lines = None
+        return sentence
+
+    def set_columns(self, comments: List[str], columns: List[List[str]]):
+        ids, forms, lemmas, upos, xpos, feats, heads, deprels, deps, misc = \
+                columns
+        self.comments: List[str] = comments
+        self.ids: List[str] = ids
+        # A form and a lemma that are both _ are taken literally
+        self.forms: List[Optional[str]] = [None if f == EMPTY and l != EMPTY
+                else f for f, l in zip(forms, lemmas)]
+        self.lemmas: List[Optional[str]] = [None if l == EMPTY and f != EMPTY
+                else l for f, l in zip(forms, lemmas)]
+        self.upos: List[Optional[str]] = [unit(v) for v in upos]
+        self.xpos: List[Optional[str]] = [unit(v) for v in xpos]
+        self.feats: List[str] = feats
+        self.heads: List[Optional[str]] = [unit(v) for v in heads]
+        self.deprels: List[Optional[str]] = [unit(v) for v in deprels]
+        self.deps: List[str] = deps
+        self.misc: List[str] = misc
+        self._meta: Optional[Dict[str, Optional[str]]] = None
+        self._tokens: Optional[List[Token]] = None
+        self._indexes: Optional[Dict[str, int]] = None
+
+    @property
+    def token_lines(self) -> List[str]:
+        if self._token_lines is None:
+            self._token_lines = ['\t'.join(EMPTY if value is None else value
+                    for value in row) for row in zip(self.ids, self.forms,
+                    self.lemmas, self.upos, self.xpos, self.feats, self.heads,
+                    self.deprels, self.deps, self.misc)]
+        return self._token_lines
+
+    @property
+    def lines(self) -> List[str]:
+        if self._lines is None:
+            self._lines = self.comments + self.token_lines
+        return self._lines
+
+    @property
+    def meta(self) -> Dict[str, Optional[str]]:
+        """The comments, parsed as by pyconll (singletons map to None)"""
+        if self._meta is None:
+            self._meta = {}
+            for comment in self.comments:
+                match = KEY_VALUE_COMMENT.match(comment)
+                if match:
+                    self._meta[match.group(1)] = match.group(2)
+                    continue
+                match = SINGLETON_COMMENT.match(comment)
+                if match:
+                    self._meta[match.group(1)] = None
+        return self._meta
+
+    @property
+    def id(self) -> Optional[str]:
+        return self.meta.get('sent_id')
+
+    @property
+    def text(self) -> Optional[str]:
+        return self.meta.get('text')
+
+    def meta_value(self, key: str) -> Optional[str]:
+        return self.meta[key]
+
+    def meta_present(self, key: str) -> bool:
+        return key in self.meta
+
+    @property
+    def tokens(self) -> List[Token]:
+        if self._tokens is None:
+            self._tokens = [Token(self, i) for i in range(len(self.ids))]
+        return self._tokens
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self) -> Iterator[Token]:
+        return iter(self.tokens)
+
+    def __getitem__(self, key: Union[int, str]) -> Token:
+        """Returns the token at an index, or with an ID"""
+        if isinstance(key, str):
+            if self._indexes is None:
+                self._indexes = {id_: i for i, id_ in enumerate(self.ids)}
+            key = self._indexes[key]
+        return self.tokens[key]
+
+    def to_tree(self) -> Tree:
+        """Builds the dependency tree
+
+        Like pyconll, leaves out tokens without a head that are multiword
+        tokens or empty nodes, orders children as in the sentence, and raises
+        ValueError with the same messages if there is no single root or
+        another token has no head."""
+        children: Dict[str, List[int]] = {}
+        for i, head in enumerate(self.heads):
+            if head is not None:
+                children.setdefault(head, []).append(i)
+            elif '-' not in self.ids[i] and '.' not in self.ids[i]:
+                raise ValueError('The current sentence is not fully defined '
+                        'as a tree and has a token with an empty head at '
+                        f'{self.ids[i]}')
+        roots = children.get('0')
+        if roots is None:
+            raise ValueError('The current sentence has no root token.')
+        if len(roots) != 1:
+            raise ValueError('There should be exactly one root token in a '
+                    'sentence.')
+        tokens = self.tokens
+        root = Tree(tokens[roots[0]], None)
+        agenda = [root]
+        while agenda:
+            tree = agenda.pop()
+            for i in children.get(self.ids[tree.data.index], ()):
+                child = Tree(tokens[i], tree)
+                tree.children.append(child)
+                agenda.append(child)
+        return root
+
+    def conll(self) -> str:
+        return '\n'.join(self.lines)
+
+
+class Conll(list):
+    """The sentences of a CoNLL-U string"""
+
+    def conll(self) -> str:
+        return ''.join(sentence.conll() + '\n\n' for sentence in self)
+
+
+def load_from_string(source: str) -> Conll:
+    """Splits source into sentences at blank lines and parses them
+
+    As in pyconll, lines of only whitespace count as blank."""
+    conll = Conll()
+    lines: List[str] = []
+    for line in source.splitlines():
+        if line and not line.isspace():
+            lines.append(line)
+        elif lines:
+            conll.append(Sentence(lines))
+            lines = []
+    if lines:
+        conll.append(Sentence(lines))
+    return conll
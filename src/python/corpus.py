@@ -0,0 +1,22 @@
+"""Finding the CUSF files of a corpus that command-line tools work on"""
+
+
+import glob
+import os
+from typing import Iterable, List
+
+
+def find_files(paths: Iterable[str]) -> List[str]:
+    """Expands files, directories (searched recursively for .cusf files) and
+    glob patterns into a sorted list of files"""
+    files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            files.update(glob.glob(os.path.join(glob.escape(path), '**', '*.cusf'),
+                    recursive=True))
+        elif glob.has_magic(path):
+            files.update(p for p in glob.glob(path, recursive=True)
+                    if os.path.isfile(p))
+        else:
+            files.add(path)
+    return sorted(files)
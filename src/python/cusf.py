@@ -1,24 +1,29 @@
 import collections
+import hashlib
 import logging
 import math
 import re
 import sys
-from typing import Callable, Dict, Iterable, List, Optional, Set, TextIO, \
-        Tuple, Union
+from typing import TYPE_CHECKING, Callable, Dict, FrozenSet, Iterable, List, \
+        Optional, Set, TextIO, Tuple, Union
 
 
-from pyconll.exception import ParseError
-from pyconll.tree import Tree as PyCoNLLTree
-from pyconll.unit.sentence import Sentence as PyCoNLLSentence
-import pyconll
+# pyconll is only imported when a block is first parsed (see load_syntax), so
+# that scripts which do not look at the syntax start without it.
+if TYPE_CHECKING:
+    from pyconll.tree import Tree as PyCoNLLTree
+    from pyconll.unit.sentence import Sentence as PyCoNLLSentence
 
 
 import blocks
+import conllu
+import diagnostics
 import labels
 
 
-# FIXME word IDs are not always ints
-FRAME_LINE = re.compile(r'\[(?P<label>[^]]*)] (?P<text>.*?) \((?P<head>\d+)\)(?: *# *(?P<comment>.*))?$')
+SYNTAX_BACKENDS = ('pyconll', 'native') # CoNLL-U parsers, see load_syntax
+syntax_backend = 'pyconll'
+FRAME_LINE = re.compile(r'\[(?P<label>[^]]*)] (?P<text>.*?) \((?P<head>\d+(?:\.\d+)?)\)(?: *# *(?P<comment>.*))?$')
 ARG_DEPS = set((
     'nsubj', 'obj', 'iobj', 'csubj', 'ccomp', 'xcomp', 'obl', 'advcl',
     'advmod', 'nmod', 'nummod', 'acl', 'amod', 'compound', 'orphan',
@@ -33,9 +38,9 @@ PRED_DEPS = ARG_DEPS | set((
 
 
 def subtrees(
-    tree: PyCoNLLTree,
-    test: Callable[[PyCoNLLTree],bool]=lambda _: True
-) -> Iterable[PyCoNLLTree]:
+    tree: 'PyCoNLLTree',
+    test: Callable[['PyCoNLLTree'],bool]=lambda _: True
+) -> Iterable['PyCoNLLTree']:
     """Returns the subtrees of the given tree
 
     If test is given, subtrees for which it returns False (and all their
@@ -46,43 +51,90 @@ def subtrees(
             yield from subtrees(child)
 
 
-def arg_subtrees(tree: PyCoNLLTree) -> Iterable[PyCoNLLTree]:
+def arg_subtrees(tree: 'PyCoNLLTree') -> Iterable['PyCoNLLTree']:
     yield tree
     for child in tree:
         if not child.data.deprel.startswith('conj'):
             yield from subtrees(child)
 
 
-def form_for_predicate(tree: PyCoNLLTree) -> str:
-    def is_mwe_tree(t: PyCoNLLTree) -> bool:
-        return t.data.deprel.split(':')[0] in ('fixed', 'flat', 'mwe', 'appos', 'goeswith')
-    trees = sorted(subtrees(tree, is_mwe_tree), key=lambda t: id_sort_key(t.data.id))
-    return ' '.join(t.data.form for t in trees)
-
-
-def form_for_argument(tree: PyCoNLLTree) -> str:
-    trees = [tree]
-    nc_children = [c for c in tree if not c.data.deprel.startswith('conj')]
-    trees.extend(s for c in nc_children for s in subtrees(c))
-    trees.sort(key=lambda t: id_sort_key(t.data.id))
-    return ' '.join(t.data.form for t in trees)
-
-
-def id_sort_key(token_id: str) -> int: # TODO support other kinds of token IDs
-    return int(token_id)
-
-
-def tree_for_token(token_id: str, tree: PyCoNLLTree) -> PyCoNLLTree:
-    for t in subtrees(tree):
-        if t.data.id == token_id:
-            return t
+def is_mwe_tree(tree: 'PyCoNLLTree') -> bool:
+    return tree.data.deprel.split(':')[0] in ('fixed', 'flat', 'mwe', 'appos', 'goeswith')
+
+
+def id_sort_key(token_id: str) -> Tuple[int, int]:
+    """Sorts token IDs in CoNLL-U order
+
+    Multiword token IDs (3-4) come right before their first word, empty node
+    IDs (5.1) after the word they follow."""
+    if '-' in token_id:
+        start, _ = token_id.split('-', 1)
+        return int(start), -1
+    if '.' in token_id:
+        word, empty = token_id.split('.', 1)
+        return int(word), int(empty)
+    return int(token_id), 0
+
+
+def index_tree(tree: 'PyCoNLLTree') -> Dict[str, 'PyCoNLLTree']:
+    """Maps the token IDs in a tree to their subtrees, in one pass
+
+    Each subtree also gives access to its token's parent (.parent), deprel
+    (.data.deprel) and children (iteration)."""
+    index = {}
+    agenda = [tree]
+    while agenda:
+        t = agenda.pop()
+        index[t.data.id] = t
+        agenda.extend(t)
+    return index
+
+
+def index_spans(tree: 'PyCoNLLTree') -> Dict[str, Tuple[str, str]]:
+    """Maps the token IDs in a tree to their predicate and argument texts
+
+    The predicate text of a token is its form with the whole subtrees of its
+    fixed, flat, mwe, appos and goeswith children (see is_mwe_tree), the
+    argument text its form with the whole subtrees of its children other
+    than conjuncts. Forms are joined by spaces in token order. The tokens of
+    every subtree are collected only once, bottom-up."""
+    order = []
+    agenda = [tree]
+    while agenda:
+        t = agenda.pop()
+        order.append(t)
+        agenda.extend(t)
+    # Tokens of each complete subtree as (sort key, form), in ID order
+    tokens = {}
+    spans = {}
+    for t in reversed(order):
+        own = (id_sort_key(t.data.id), t.data.form)
+        full = [own]
+        pred = [own]
+        arg = [own]
+        for child in t:
+            child_tokens = tokens.pop(child.data.id)
+            full.extend(child_tokens)
+            if is_mwe_tree(child):
+                pred.extend(child_tokens)
+            if not child.data.deprel.startswith('conj'):
+                arg.extend(child_tokens)
+        full.sort()
+        pred.sort()
+        arg.sort()
+        tokens[t.data.id] = full
+        spans[t.data.id] = (
+            ' '.join(form for _, form in pred),
+            ' '.join(form for _, form in arg),
+        )
+    return spans
 
 
 def remove_features(deprel: str) -> str:
     return re.split(r'[:@]', deprel)[0]
 
 
-def is_semantic_predicate(tree: PyCoNLLTree) -> bool:
+def is_semantic_predicate(tree: 'PyCoNLLTree') -> bool:
     # Prevent spuriously including function word conjuncts
     if tree.data.deprel == 'conj' and tree.parent \
             and not is_semantic_predicate(tree.parent):
@@ -94,12 +146,14 @@ def is_semantic_predicate(tree: PyCoNLLTree) -> bool:
     return any(tree.data.deprel.startswith(r) for r in PRED_DEPS)
 
 
-def is_semantic_dependent(tree: PyCoNLLTree) -> bool:
+def is_semantic_dependent(tree: 'PyCoNLLTree') -> bool:
     return any(tree.data.deprel.startswith(r) for r in ARG_DEPS)
 
 
 class Arg:
 
+    __slots__ = ('head', 'text', 'label', 'comment')
+
     def __init__(self, head: str, text: str, label: str, comment: str):
         self.head = head
         self.text = text
@@ -116,9 +170,9 @@ class Arg:
     @staticmethod
     def from_line(line: str) -> 'Arg':
         m = FRAME_LINE.match(line)
-        head = m.group('head')
+        head = sys.intern(m.group('head'))
         text = m.group('text')
-        label = m.group('label')
+        label = sys.intern(m.group('label'))
         comment = m.group('comment') or ''
         arg = Arg(head, text, label, comment)
         return arg
@@ -126,6 +180,8 @@ class Arg:
 
 class Frame:
 
+    __slots__ = ('head', 'text', 'label', 'comment', 'args')
+
     def __init__(self, head: str, text: str = '', label: str='',
             comment:str ='', args: Optional[List[Arg]]=None):
         self.head = head
@@ -172,82 +228,62 @@ class Frame:
     def is_completely_annotated(self) -> bool:
         return self.label and all(a.label for a in self.args)
 
-    def check(self, sentence: 'Sentence', lineno: int) -> Tuple[bool, int]:
-        # Convert sentence to tree
-        tree = sentence.syntax[0].to_tree()
+    def check(self, sentence: 'Sentence', lineno: int,
+            collector: diagnostics.Collector=diagnostics.LOG) \
+            -> Tuple[bool, int]:
+        def report(code, line, token, *args, level=logging.WARNING):
+            collector.add(diagnostics.Diagnostic(level, code,
+                    sentence.syntax[0].id, line, token, args))
         # Find subtree corresponding to predicate
-        pred_tree = tree_for_token(self.head, tree)
+        pred_tree = sentence.tree_for_token(self.head)
         if pred_tree is None:
-            logging.warning(
-                'sent %s line %s token %s not found in syntax',
-                sentence.syntax[0].id, lineno, self.head,
-            )
+            report('token-not-found', lineno, self.head, self.head)
             return False, 1
         # Check for wrong text
-        expected_text = form_for_predicate(pred_tree)
+        expected_text = sentence.predicate_text(self.head)
         if self.text != expected_text:
-            logging.warning(
-                'sent %s line %s wrong text for frame: '
-                'is "%s" but should be "%s"',
-                sentence.syntax[0].id, lineno, self.text, expected_text,
-            )
+            report('wrong-frame-text', lineno, self.head, self.text,
+                    expected_text)
         # Check for missing frame label
         if not self.label:
             return False, 0
         # Check for wrong frame label
         if not labels.check_frame_label(self.label):
-            logging.warning('sent %s line %s unknown frame label: %s',
-                    sentence.syntax[0].id, lineno, self.label)
+            report('unknown-frame-label', lineno, self.head, self.label)
             return False, 1
         # Check arguments
         ok = True
         warnings = 0
         for i, arg in enumerate(self.args, start=lineno + 1):
-            # Find token corresponding to argument
-            try:
-                arg_token = sentence.syntax[0][arg.head]
-            except KeyError:
-                logging.warning(
-                    'sent %s line %s token % not found in syntax',
-                    sentence.syntax[0].id, i, arg.head,
-                )
-                return False, 1
-            arg_tree = tree_for_token(arg.head, tree)
+            # Find subtree corresponding to argument
+            arg_tree = sentence.tree_for_token(arg.head)
             if arg_tree is None:
-                logging.warning(
-                    'sent %s line %s token % not found in syntax',
-                    sentence.syntax[0].id, i, arg.head,
-                )
+                report('token-not-found', i, arg.head, arg.head)
                 return False, 1
+            arg_token = arg_tree.data
             # Check for wrong text
             if arg_token.head == self.head:
-                expected_text = form_for_argument(arg_tree)
+                expected_text = sentence.argument_text(arg.head)
                 if arg.text != expected_text:
-                    logging.warning(
-                        'sent %s line %s wrong text for subtree with root %s: '
-                        'is "%s" but should be "%s"',
-                        sentence.syntax[0].id, i,
-                        arg.head, arg.text, expected_text,
-                    )
+                    report('wrong-arg-text', i, arg.head, arg.head, arg.text,
+                            expected_text)
             else:
                 expected_text = arg_token.form
                 # We don't check in this case, for now.
             # Check for annotated appos edges:
-            arg_token = sentence.syntax[0][arg.head]
             if arg_token.head == self.head and \
                     arg_token.deprel.startswith('appos'):
-                logging.warning('sent %s line %s appos edges should not be '
-                        'annotated', sentence.syntax[0].id, i)
+                report('appos-edge', i, arg.head)
             # Check for wrong dep label
             if not labels.check_dep_label(arg.label, self.label):
-                logging.warning('sent %s line %s unknown dep label for %s: %s',
-                        sentence.syntax[0].id, i, self.label, arg.label)
+                report('unknown-dep-label', i, arg.head, self.label,
+                        arg.label)
                 ok = False
                 warnings += 1
             # Check for missing depictive backlinks
             if arg.label in ('m-depictive', 'x-depictive'):
                 arg_trees = [
-                    tree_for_token(a.head, tree)
+                    sentence.tree_for_token(a.head)
                     for a in self.args
                     if a.head != arg.head
                 ]
@@ -262,18 +298,10 @@ class Frame:
                         for arg2 in frame.args:
                             if arg2.head in subtree_ids:
                                 backlink_found = True
-                                logging.debug(
-                                    'sent %s line %s found backlink: %s',
-                                    sentence.syntax[0].id,
-                                    i,
-                                    arg2.head,
-                                )
+                                report('found-backlink', i, arg.head,
+                                        arg2.head, level=logging.DEBUG)
                 if not backlink_found:
-                    logging.warning(
-                        'sent %s line %s depictive has to share an argument with its parent frame',
-                        sentence.syntax[0].id,
-                        i,
-                    )
+                    report('missing-backlink', i, arg.head)
                     ok = False
                     warnings += 1
         return ok, warnings
@@ -281,51 +309,164 @@ class Frame:
     @staticmethod
     def from_block(block: blocks.Block) -> 'Frame':
         m = FRAME_LINE.match(block[0])
-        head = m.group('head')
+        head = sys.intern(m.group('head'))
         text = m.group('text')
-        label = m.group('label')
+        label = sys.intern(m.group('label'))
         comment = m.group('comment') or ''
         frame = Frame(head, text, label, comment)
         for line in block[1:]:
             frame.args.append(Arg.from_line(line))
         return frame
 
-    @staticmethod
-    def init_from_tree(tree: PyCoNLLTree) -> 'Frame':
-        frame = Frame(tree.data.id, form_for_predicate(tree))
-        return frame
-
 
 """Can't parse a frame? Represent it as a block."""
 Frameish = Union[Frame, blocks.Block]
 
 
+def parse_frame(block: blocks.Block) -> Frameish:
+    try:
+        return Frame.from_block(block)
+    except:
+        return block
+
+
 class Sentence:
 
-    syntax: PyCoNLLSentence
+    __slots__ = ('_syntax', 'lineno', '_frames', '_frame_blocks', 'frame_linenos',
+            'source_hash', '_tree', '_index', '_spans', '_frame_index',
+            '_reachable')
+
     lineno: int
-    frames: List[Frameish]
     frame_linenos: List[int]
 
-    def __init__(self, syntax: PyCoNLLSentence, lineno: int):
+    def __init__(self, syntax: 'PyCoNLLSentence', lineno: int):
         self.syntax = syntax
         self.lineno = lineno
         self.frames = []
         self.frame_linenos = []
-
-    def add_frame(self, block: blocks.Block, lineno: int):
-        try:
-            frame = Frame.from_block(block)
-            self.frames.append(frame)
-        except:
-            self.frames.append(block)
+        self.source_hash = hashlib.sha256() # of the blocks read by read()
+
+    @property
+    def syntax(self) -> 'PyCoNLLSentence':
+        return self._syntax
+
+    @syntax.setter
+    def syntax(self, syntax: 'PyCoNLLSentence'):
+        self._syntax = syntax
+        self.invalidate()
+
+    @property
+    def frames(self) -> List[Frameish]:
+        """The frames, parsed on first access if they were added lazily"""
+        if self._frame_blocks is not None:
+            self._frames = [parse_frame(block) for block in self._frame_blocks]
+            self._frame_blocks = None
+        return self._frames
+
+    @frames.setter
+    def frames(self, frames: List[Frameish]):
+        self._frames = frames
+        self._frame_blocks = None
+
+    def invalidate(self):
+        """Discards everything computed from the syntax and frames
+
+        Assigning to syntax does this automatically. Call it explicitly after
+        modifying tokens in place."""
+        self._tree = None
+        self._index = None
+        self._spans = None
+        self.invalidate_frames()
+
+    def invalidate_frames(self):
+        """Discards everything computed from the frames
+
+        Call it after adding, removing or relabeling frames or args."""
+        self._frame_index = None
+        self._reachable = {}
+
+    @property
+    def tree(self) -> 'PyCoNLLTree':
+        """The dependency tree, built on first access
+
+        Raises ValueError if the syntax is not a valid tree."""
+        if self._tree is None:
+            self._tree = self.syntax[0].to_tree()
+        return self._tree
+
+    def tree_for_token(self, token_id: str) -> Optional['PyCoNLLTree']:
+        """Returns the subtree rooted in the given token, or None"""
+        if self._index is None:
+            self._index = index_tree(self.tree)
+        return self._index.get(token_id)
+
+    def predicate_text(self, token_id: str) -> str:
+        """Returns the text of the token as a predicate (see index_spans)"""
+        if self._spans is None:
+            self._spans = index_spans(self.tree)
+        return self._spans[token_id][0]
+
+    def argument_text(self, token_id: str) -> str:
+        """Returns the text of the token as an argument (see index_spans)"""
+        if self._spans is None:
+            self._spans = index_spans(self.tree)
+        return self._spans[token_id][1]
+
+    def has_frame_labels(self) -> bool:
+        """Tells whether any frame may have a label
+
+        Frames that have not been parsed yet (see read) are judged by their
+        first line without parsing them, so unparseable ones may count."""
+        if self._frame_blocks is not None:
+            return any(not block or not block[0].startswith('[]')
+                    for block in self._frame_blocks)
+        return any(isinstance(frame, Frame) and frame.label
+                for frame in self._frames)
+
+    def add_frame(self, block: blocks.Block, lineno: int, lazy: bool=False):
+        """Adds a frame block after the others
+
+        If lazy is true and no frames have been parsed yet, the block is only
+        parsed when the frames are first accessed."""
+        if lazy and (self._frame_blocks is not None or not self._frames):
+            if self._frame_blocks is None:
+                self._frame_blocks = []
+            self._frame_blocks.append(block)
+        else:
+            self.frames.append(parse_frame(block))
         self.frame_linenos.append(lineno)
+        self.invalidate_frames()
 
     def get_frame(self, head: str) -> Optional[Frame]:
-        """Returns the frame with the given head ID, or None"""
-        for frame in self.frames:
-            if frame.head == head:
-                return frame
+        """Returns the (first) frame with the given head ID, or None"""
+        if self._frame_index is None:
+            self._frame_index = {}
+            for frame in self.frames:
+                if isinstance(frame, Frame):
+                    self._frame_index.setdefault(frame.head, frame)
+        return self._frame_index.get(head)
+
+    def reachable(self, head: str) -> FrozenSet[str]:
+        """Returns the head IDs reachable via semantic links from head
+
+        The result for each head is computed once and kept until
+        invalidate_frames is called."""
+        if head not in self._reachable:
+            seen = set()
+            agenda = [head]
+            while agenda:
+                head_ = agenda.pop()
+                seen.add(head_)
+                match self.get_frame(head_):
+                    case None:
+                        pass
+                    case frame:
+                        for arg in frame.args:
+                            if arg.label:
+                                if arg.head not in seen:
+                                    agenda.append(arg.head)
+            self._reachable[head] = frozenset(seen)
+        return self._reachable[head]
 
     def traverse(self, head: str) -> Set[str]:
         """Traverses the semantic graph.
@@ -333,61 +474,64 @@ class Sentence:
         Returns the head IDs of frames that are reachable via semantic links
         from the one with the given head ID.
         """
-        seen = set()
-        agenda = [head]
-        while agenda:
-            head = agenda.pop()
-            seen.add(head)
-            match self.get_frame(head):
-                case None:
-                    pass
-                case frame:
-                    for arg in frame.args:
-                        if arg.label:
-                            if arg.head not in seen:
-                                agenda.append(arg.head)
-        return seen
+        return set(self.reachable(head))
 
     def link_exists(self, ancestor_head: str, descendant_head: str) -> bool:
-        return descendant_head in self.traverse(ancestor_head)
+        return descendant_head in self.reachable(ancestor_head)
 
-    def deep_link_exists(self: str, ancestor_head: str, descendant_head: str) -> bool:
-        return any(
-            self.link_exists(a, descendant_head)
-            for a in self.traverse(ancestor_head)
-        )
+    def deep_link_exists(self, ancestor_head: str, descendant_head: str) -> bool:
+        # Everything reachable from something reachable from ancestor_head is
+        # reachable from ancestor_head, so this is the same as link_exists.
+        return self.link_exists(ancestor_head, descendant_head)
 
-    def fill(self):
-        """Add missing frames/args"""
+    def fill(self, collector: diagnostics.Collector=diagnostics.LOG):
+        """Add missing frames/args
+
+        Each phase is a method of its own, so that they can be profiled (see
+        profiling.py)."""
         # Phase 0: ignore sentences with syntax errors
         if not all(isinstance(f, Frame) for f in self.frames):
             return
         # Phase 1: collect expected frame-arg links
         expected_links = collections.defaultdict(list)
-        # Phase 1a: syntactic links
-        for sentence in self.syntax:
+        if self.syntax:
             try:
-                tree = sentence.to_tree()
+                self.tree
             except ValueError as e:
-                logging.warning('sent %s line %s invalid syntax: %s', sentence.id, self.lineno, e)
+                collector.add(diagnostics.Diagnostic(logging.WARNING,
+                        'invalid-syntax', self.syntax[0].id, self.lineno, None,
+                        (str(e),)))
                 return
-            for subtree in subtrees(sentence.to_tree()):
-                if is_semantic_predicate(subtree):
-                    for child in subtree:
-                        if is_semantic_dependent(child):
-                            arg_tree = tree_for_token(child.data.id, tree)
-                            expected_links[subtree.data.id].append((
-                                child.data.id,
-                                form_for_argument(arg_tree),
-                            ))
-                            for grandchild in child:
-                                if grandchild.data.deprel.startswith('conj'):
-                                    arg_tree = tree_for_token(grandchild.data.id, tree)
-                                    expected_links[subtree.data.id].append((
-                                        grandchild.data.id,
-                                        form_for_argument(arg_tree)
-                                    ))
-        # Phase 1b: participant-scene links
+            self.collect_syntactic_links(expected_links)
+        self.collect_scene_links(expected_links)
+        self.collect_content_links(expected_links)
+        # Phase 2: remove empty frames
+        self.remove_empty_frames()
+        # Phase 3: add missing frames and args
+        if self.syntax:
+            self.add_missing_frames(expected_links)
+
+    def collect_syntactic_links(self,
+            expected_links: Dict[str, List[Tuple[str, str]]]):
+        """Phase 1a of fill: links from predicates to their dependents"""
+        for subtree in subtrees(self.tree):
+            if is_semantic_predicate(subtree):
+                for child in subtree:
+                    if is_semantic_dependent(child):
+                        expected_links[subtree.data.id].append((
+                            child.data.id,
+                            self.argument_text(child.data.id),
+                        ))
+                        for grandchild in child:
+                            if grandchild.data.deprel.startswith('conj'):
+                                expected_links[subtree.data.id].append((
+                                    grandchild.data.id,
+                                    self.argument_text(grandchild.data.id),
+                                ))
+
+    def collect_scene_links(self,
+            expected_links: Dict[str, List[Tuple[str, str]]]):
+        """Phase 1b of fill: participant-scene links"""
         for frame in self.frames:
             if frame.label.split('-')[0] == 'SCENE':
                 participant = frame.find_arg('participant')
@@ -410,7 +554,10 @@ class Sentence:
                     protoarg = (frame.head, frame.text)
                     if not self.deep_link_exists(arg.head, frame.head):
                         expected_links[arg.head].append(protoarg)
-        # Phase 1c: topic-content links
+
+    def collect_content_links(self,
+            expected_links: Dict[str, List[Tuple[str, str]]]):
+        """Phase 1c of fill: topic-content links"""
         for frame in self.frames:
             if frame.label.split('-')[0] == 'MESSAGE':
                 topic = frame.find_arg('topic')
@@ -432,73 +579,167 @@ class Sentence:
                 if arg.label == 'm-content' and not self.deep_link_exists(arg.head, frame.head):
                     protoarg = (frame.head, frame.text)
                     expected_links[arg.head].append(protoarg)
-        # Phase 2: remove empty frames
+
+    def remove_empty_frames(self):
+        """Phase 2 of fill"""
         self.frames = [f for f in self.frames if not f.is_empty()]
-        # Phase 3: add missing frames and args
-        cursor = 0 # index at which we insert the next missing frame
-        for sentence in self.syntax:
-            for tree in subtrees(sentence.to_tree()):
-                if is_semantic_predicate(tree):
-                    frame_already_present = False
-                    for index, frame in enumerate(self.frames):
-                        if frame.head == tree.data.id:
-                            frame_already_present = True
-                            frame.fill_args(expected_links[frame.head])
-                            cursor = index + 1
-                            break
-                    if not frame_already_present:
-                        frame = Frame.init_from_tree(tree)
-                        frame.fill_args(expected_links[frame.head])
-                        self.frames.insert(cursor, frame)
-                        cursor += 1
-
-    def check(self, warn_non_semantic_dependent: bool=False) -> Tuple[int, int, int]:
+        self.invalidate_frames()
+
+    def add_missing_frames(self, expected_links: Dict[str, List[Tuple[str, str]]]):
+        """Fills in the args of each predicate's frame, adding missing frames
+
+        Visits predicates in tree order. A missing frame goes right after the
+        frame of the last predicate visited that had one (or after other
+        missing frames that went there before it). The result is assembled
+        in one pass, with existing frames found via a head index."""
+        first_index = {}
+        for index, frame in enumerate(self.frames):
+            first_index.setdefault(frame.head, index)
+        # slots[i] holds the missing frames to go before self.frames[i]
+        slots = [[] for _ in range(len(self.frames) + 1)]
+        cursor = 0
+        for tree in subtrees(self.tree):
+            if is_semantic_predicate(tree):
+                index = first_index.get(tree.data.id)
+                if index is None:
+                    frame = Frame(tree.data.id, self.predicate_text(tree.data.id))
+                    frame.fill_args(expected_links[frame.head])
+                    slots[cursor].append(frame)
+                else:
+                    frame = self.frames[index]
+                    frame.fill_args(expected_links[frame.head])
+                    cursor = index + 1
+        frames = slots[0]
+        for frame, slot in zip(self.frames, slots[1:]):
+            frames.append(frame)
+            frames.extend(slot)
+        self.frames = frames
+        self.invalidate_frames()
+
+    def check(self, warn_non_semantic_dependent: bool=False,
+            collector: diagnostics.Collector=diagnostics.LOG) \
+            -> Tuple[int, int, int]:
         head_frame_map = {}
         head_lineno_map = {}
         for frame_lineno, frame in zip(self.frame_linenos, self.frames):
             if isinstance(frame, Frame):
                 if frame.head in head_frame_map:
-                    logging.warning(
-                        'sent %s line %s duplicate frame for head word %s',
-                        self.syntax[0].id, frame_lineno, frame.head,
-                    )
+                    collector.add(diagnostics.Diagnostic(logging.WARNING,
+                            'duplicate-frame', self.syntax[0].id, frame_lineno,
+                            frame.head, (frame.head,)))
                 else:
                     head_frame_map[frame.head] = frame
                     head_lineno_map[frame.head] = frame_lineno
             else:
-                logging.warning('sent %s line %s cannot parse frame %s',
-                        self.syntax[0].id, frame_lineno, repr('\n'.join(frame)))
+                collector.add(diagnostics.Diagnostic(logging.WARNING,
+                        'unparseable-frame', self.syntax[0].id, frame_lineno,
+                        None, (repr('\n'.join(frame)),)))
         annotated_count = 0
         warnings = 0
         for frame in head_frame_map.values():
-            ok, w = frame.check(self, head_lineno_map[frame.head])
+            ok, w = frame.check(self, head_lineno_map[frame.head], collector)
             if ok:
                 annotated_count += 1
             warnings += w
         return len(head_frame_map), annotated_count, warnings
 
-    def write(self, io: TextIO=sys.stdout):
-        print(self.syntax.conll(), file=io, end='')
-        for frame in self.frames:
-            if isinstance(frame, Frame):
-                blocks.write(frame.to_block(), io=io)
-            else:
-                blocks.write(frame, io=io)
-
-def read(io: TextIO=sys.stdin) -> Iterable[Sentence]:
+    def write(self, io: TextIO=sys.stdout, lineno: Optional[int]=None):
+        """Writes the sentence with its frames
+
+        If lineno is given, lineno and frame_linenos are updated to where
+        things end up when the output starts at that line."""
+        syntax = self.syntax.conll()
+        print(syntax, file=io, end='')
+        if lineno is not None:
+            self.lineno = lineno
+            self.frame_linenos = []
+            lineno += syntax.count('\n')
+        # Frames that were never parsed are written as they were read
+        frames = self.frames if self._frame_blocks is None \
+                else self._frame_blocks
+        for frame in frames:
+            block = frame.to_block() if isinstance(frame, Frame) else frame
+            blocks.write(block, io=io)
+            if lineno is not None:
+                self.frame_linenos.append(lineno)
+                lineno += len(block) + 1
+
+def is_frame_block(block: blocks.Block) -> bool:
+    """Tells whether a block is certainly not a CoNLL-U sentence
+
+    CoNLL-U lines are either comments or have tab-separated columns, so any
+    other nonempty line means the block is a frame (or an unparseable frame).
+    This saves us a failed pyconll parse for every frame block."""
+    for line in block:
+        line = line.strip()
+        if line and line[0] != '#' and '\t' not in line:
+            return True
+    return False
+
+
+def load_syntax(source: str) -> 'PyCoNLLSentence':
+    """Parses CoNLL-U with the parser named by syntax_backend
+
+    pyconll is imported on first use. The native parser (conllu.py) gives
+    objects with the same interface, which serialize to the original
+    lines."""
+    if syntax_backend == 'native':
+        return conllu.load_from_string(source)
+    import pyconll
+    return pyconll.load_from_string(source)
+
+
+def syntax_error() -> type:
+    """Returns the exception load_syntax raises for non-CoNLL-U input"""
+    if syntax_backend == 'native':
+        return conllu.ParseError
+    from pyconll.exception import ParseError
+    return ParseError
+
+
+def parse_block(block: blocks.Block, source: str,
+        syntax_cache: Optional[Dict[str, Optional['PyCoNLLSentence']]]=None) \
+        -> Optional['PyCoNLLSentence']:
+    """Parses a block as CoNLL-U, returning None if it is not a sentence
+
+    source is the block joined by newlines. See read for syntax_cache."""
+    if syntax_cache is not None and source in syntax_cache:
+        return syntax_cache[source]
+    if is_frame_block(block):
+        return None
+    try:
+        syntax = load_syntax(source)
+    except syntax_error():
+        syntax = None
+    if syntax_cache is not None:
+        syntax_cache[source] = syntax
+    return syntax
+
+
+def read(io: TextIO=sys.stdin, lineno: int=1, lazy: bool=False,
+        syntax_cache: Optional[Dict[str, Optional['PyCoNLLSentence']]]=None) \
+        -> Iterable[Sentence]:
+    """Reads sentences with their frames
+
+    lineno is the line number of the first line, for when io starts in the
+    middle of a file. If lazy is true, the frames of a sentence are only
+    parsed when they are first accessed (see Sentence.frames). If syntax_cache is given, it maps
+    the text of blocks to their parses (None if not CoNLL-U), and is used
+    and extended instead of parsing blocks again."""
     current_sentence = None
-    lineno = 1
     for block in blocks.read(io):
-        try:
-            new_sentence = Sentence(
-                pyconll.load_from_string('\n'.join(block)),
-                lineno,
-            )
+        source = '\n'.join(block)
+        syntax = parse_block(block, source, syntax_cache)
+        if syntax is None:
+            if current_sentence is None:
+                raise ValueError(f'line {lineno}: frame before first sentence')
+            current_sentence.add_frame(block, lineno, lazy)
+        else:
             if current_sentence:
                 yield current_sentence
-            current_sentence = new_sentence
-        except ParseError:
-            current_sentence.add_frame(block, lineno)
+            current_sentence = Sentence(syntax, lineno)
+        current_sentence.source_hash.update(source.encode())
+        current_sentence.source_hash.update(b'\n\n')
         lineno += len(block) + 1
     if current_sentence:
         yield current_sentence
@@ -0,0 +1,123 @@
+"""Structured diagnostics for CUSF files
+
+Checks report problems as Diagnostic records, which carry a code and the
+arguments of the message rather than the message itself, to a Collector. The
+default collector logs them, which gives the traditional output of check.py;
+others keep them for caching, filtering or rendering in other formats.
+"""
+
+
+import collections
+import json
+import logging
+import sys
+from typing import Iterable, List, NamedTuple, Optional, Sequence, TextIO, \
+        Tuple
+
+
+MESSAGES = {
+    'token-not-found': 'token %s not found in syntax',
+    'wrong-frame-text': 'wrong text for frame: is "%s" but should be "%s"',
+    'unknown-frame-label': 'unknown frame label: %s',
+    'wrong-arg-text': 'wrong text for subtree with root %s: is "%s" but should be "%s"',
+    'appos-edge': 'appos edges should not be annotated',
+    'unknown-dep-label': 'unknown dep label for %s: %s',
+    'found-backlink': 'found backlink: %s',
+    'missing-backlink': 'depictive has to share an argument with its parent frame',
+    'invalid-syntax': 'invalid syntax: %s',
+    'duplicate-frame': 'duplicate frame for head word %s',
+    'unparseable-frame': 'cannot parse frame %s',
+    'incomplete-sentence': 'annotation of sentence not complete',
+    'cannot-check-sentence': 'cannot check sentence: %s',
+    'cannot-check-file': 'cannot check file: %s',
+    'cannot-use-cache': 'cannot use cache %s: %s',
+}
+
+
+class Diagnostic(NamedTuple):
+    level: int # logging level
+    code: str # key of MESSAGES
+    sent_id: Optional[str]
+    line: Optional[int]
+    token: Optional[str] # ID of the head the problem is about, if any
+    args: Tuple = () # arguments for the message, JSON-serializable
+
+    @property
+    def message(self) -> str:
+        return MESSAGES[self.code] % self.args
+
+    def __str__(self) -> str:
+        if self.line is None:
+            return self.message
+        return f'sent {self.sent_id} line {self.line} {self.message}'
+
+    @staticmethod
+    def from_row(row: Sequence) -> 'Diagnostic':
+        """Makes a diagnostic from a tuple or list, e.g. one read from JSON"""
+        level, code, sent_id, line, token, args = row
+        return Diagnostic(level, code, sent_id, line, token, tuple(args))
+
+
+class Collector:
+    """Receives diagnostics; this one logs them
+
+    Messages are only formatted if the log level lets them through."""
+
+    def add(self, diagnostic: Diagnostic):
+        logging.log(diagnostic.level, '%s', diagnostic)
+
+    def extend(self, diagnostics: Iterable[Sequence]):
+        """Adds diagnostics, given as Diagnostic objects or rows"""
+        for row in diagnostics:
+            self.add(Diagnostic.from_row(row))
+
+
+class ListCollector(Collector):
+
+    def __init__(self):
+        self.diagnostics: List[Diagnostic] = []
+
+    def add(self, diagnostic: Diagnostic):
+        self.diagnostics.append(diagnostic)
+
+
+LOG = Collector()
+
+
+def render_log(diagnostics: Iterable[Diagnostic]):
+    LOG.extend(diagnostics)
+
+
+def render_jsonl(diagnostics: Iterable[Diagnostic], file: Optional[str]=None,
+        io: TextIO=sys.stdout, level: int=logging.INFO):
+    """Writes diagnostics of at least the given level as JSON lines"""
+    for d in diagnostics:
+        if d.level < level:
+            continue
+        print(json.dumps({
+            'file': file,
+            'level': logging.getLevelName(d.level),
+            'code': d.code,
+            'sent_id': d.sent_id,
+            'line': d.line,
+            'token': d.token,
+            'args': list(d.args),
+            'message': d.message,
+        }, ensure_ascii=False), file=io)
+
+
+def render_table(diagnostics: Iterable[Tuple[str, Diagnostic]],
+        io: TextIO=sys.stdout, level: int=logging.INFO):
+    """Prints how often each code occurs, given (file, diagnostic) pairs"""
+    counts: collections.Counter = collections.Counter()
+    files = collections.defaultdict(set)
+    for file, d in diagnostics:
+        if d.level < level:
+            continue
+        counts[d.level, d.code] += 1
+        files[d.level, d.code].add(file)
+    print(f'{"count":>7} {"files":>6}  {"level":<8} code', file=io)
+    for (l, code), count in sorted(counts.items(),
+            key=lambda item: (-item[1], item[0])):
+        print(f'{count:>7} {len(files[l, code]):>6}  '
+                f'{logging.getLevelName(l):<8} {code}', file=io)
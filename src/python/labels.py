@@ -1,3 +1,4 @@
+import functools
 import re
 
 
@@ -37,6 +38,23 @@ class Flexible:
             (role.startswith('transitory-') and role[11:] == self.arg2)
         )
 
+    def core_roles(self, aspect):
+        """The roles check_core accepts for the given aspect"""
+        if aspect in ('INIT', 'PREVENTION'):
+            prefixes = ('target-', 'transitory-')
+        elif aspect in ('DEINIT', 'CONTINUATION'):
+            prefixes = ('initial-', 'transitory-')
+        elif aspect == 'CHANGE':
+            prefixes = ('target-', 'initial-', 'transitory-')
+        else:
+            prefixes = ('',)
+        return frozenset((self.arg1,) + tuple(p + self.arg2 for p in prefixes))
+
+    def noncore_roles(self):
+        """The roles check_noncore accepts"""
+        return frozenset((self.arg1, self.arg2, 'target-' + self.arg2,
+                'initial-' + self.arg2, 'transitory-' + self.arg2))
+
 
 class Rigid:
 
@@ -51,6 +69,16 @@ class Rigid:
     def check_noncore(self, role):
         return role in self.roles
 
+    def core_roles(self, aspect):
+        """The roles check_core accepts for the given aspect"""
+        if aspect is not None:
+            return frozenset()
+        return frozenset(self.roles)
+
+    def noncore_roles(self):
+        """The roles check_noncore accepts"""
+        return frozenset(self.roles)
+
 
 FRAMES = {
     'SITUATION': Flexible('theme', 'situator'),
@@ -106,12 +134,21 @@ FRAME_PATTERN = re.compile('(' + '|'.join(FRAMES.keys()) + ')(?:-(' +
         '|'.join(ASPECTS) + '))?(?:-(' + '|'.join(MODES) + '))?(?:-(' +
         '|'.join(POLARITIES) + '))?$')
 SEPARATOR_PATTERN = re.compile(r' (?:>>|\|\|) ')
+# Roles allowed as m-/x- roles, i.e., accepted by some frame's check_noncore
+NONCORE_ROLES = frozenset().union(*(v.noncore_roles() for v in FRAMES.values()))
+# (frame, aspect) -> roles accepted by check_core
+CORE_ROLES = {
+    (f, a): v.core_roles(a)
+    for f, v in FRAMES.items()
+    for a in (None,) + ASPECTS
+}
 
 
 def split_label(label):
     return SEPARATOR_PATTERN.split(label)
 
 
+@functools.lru_cache(maxsize=4096)
 def check_frame_label(frame):
     return all(check_frame_label_part(p) for p in split_label(frame))
 
@@ -120,6 +157,16 @@ def check_frame_label_part(frame):
     return FRAME_PATTERN.match(frame)
 
 
+@functools.lru_cache(maxsize=4096)
+def parse_frame_label_part(frame):
+    """Returns (frame, aspect, mode, polarity), or None if invalid"""
+    mtch = FRAME_PATTERN.match(frame)
+    if mtch is None:
+        return None
+    return mtch.groups()
+
+
+@functools.lru_cache(maxsize=4096)
 def check_dep_label(dep, frame):
     frame_label_parts = split_label(frame)
     dep_label_parts = split_label(dep)
@@ -137,13 +184,9 @@ def check_dep_label(dep, frame):
 
 def check_dep_label_part(dep, frame):
     if dep[:2] in ('m-', 'x-'):
-        role = dep[2:]
-        return any(v.check_noncore(role) for v in FRAMES.values())
-    mtch = FRAME_PATTERN.match(frame)
-    f = mtch.group(1)
-    a = mtch.group(2)
-    m = mtch.group(3)
-    return FRAMES[f].check_core(a, m, dep)
+        return dep[2:] in NONCORE_ROLES
+    f, a, m, p = parse_frame_label_part(frame)
+    return dep in CORE_ROLES[f, a]
 
 
 def simplify(part):
@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+
+
+"""Language server for CUSF files.
+
+Speaks the Language Server Protocol on standard input and output, so that
+editors can show the warnings of check.py while you type and complete frame
+and role labels. For example, for Neovim:
+
+    vim.lsp.start({name = 'cusf', cmd = {'python3', 'src/python/lsp.py'}})
+
+Documents are kept as lists of sentences (each with its frames), and an edit
+only causes the sentences it touches to be parsed and checked again. Unlike
+check.py, the server never changes files; missing frames are added when you
+run check.py.
+"""
+
+
+import argparse
+import bisect
+import json
+import logging
+import os
+import queue
+import re
+import sys
+import threading
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+
+import cache
+import check
+import cusf
+import diagnostics
+import labels
+
+
+SEVERITIES = { # log level -> LSP DiagnosticSeverity
+    logging.ERROR: 1,
+    logging.WARNING: 2,
+    logging.INFO: 3,
+}
+LABEL = re.compile(r'\[(?P<label>[^]]*)')
+NEWLINE = re.compile(r'\r\n|\r|\n')
+
+
+def utf16_length(text: str) -> int:
+    return len(text.encode('utf-16-le')) // 2
+
+
+def from_utf16(line: str, character: int) -> int:
+    """Converts an LSP character offset into an index into line"""
+    if line.isascii():
+        return min(character, len(line))
+    units = 0
+    for index, char in enumerate(line):
+        if units >= character:
+            return index
+        units += 2 if ord(char) > 0xffff else 1
+    return len(line)
+
+
+class Chunk:
+    """A sentence with its frames, as a range of lines of a document
+
+    The line numbers of diagnostics are relative to start (counting from 1),
+    so they stay valid when edits above move the chunk."""
+
+    __slots__ = ('start', 'end', 'diagnostics')
+
+    def __init__(self, start: int, end: int):
+        self.start = start
+        self.end = end
+        self.diagnostics: Optional[List[diagnostics.Diagnostic]] = None
+
+
+class Document:
+
+    def __init__(self, uri: str, text: str, version: Optional[int]=None):
+        self.uri = uri
+        self.version = version
+        self.lines = NEWLINE.split(text)
+        self.syntax_cache: check.SyntaxCache = {}
+        self.chunks: List[Chunk] = []
+        self.starts: List[int] = [] # chunk starts, for bisecting
+        self.split(0, 0, None)
+
+    @property
+    def line_count(self) -> int:
+        """The number of lines, not counting the empty one after a final newline"""
+        return len(self.lines) - (self.lines[-1] == '')
+
+    def text(self, chunk: Chunk) -> str:
+        return '\n'.join(self.lines[chunk.start:chunk.end]) + '\n'
+
+    def split(self, index: int, edit_end: int, resync: Optional[Dict[int, int]]):
+        """Divides lines into chunks, starting with chunk index
+
+        Once a chunk starts after line edit_end at a line that resync maps
+        to the index of an old chunk, the old chunks from there on are kept."""
+        start = self.chunks[index].start if index < len(self.chunks) else 0
+        old_chunks = self.chunks
+        chunks = old_chunks[:index]
+        line_count = self.line_count
+        block_start = start
+        kept = None
+        for i in range(start, line_count + 1):
+            if i < line_count and self.lines[i]:
+                continue
+            # lines[block_start:i] is a block
+            block = self.lines[block_start:i]
+            if not chunks or cusf.parse_block(block, '\n'.join(block),
+                    self.syntax_cache) is not None:
+                if resync is not None and block_start > edit_end \
+                        and block_start in resync:
+                    kept = resync[block_start]
+                    break
+                if chunks:
+                    chunks[-1].end = block_start
+                chunks.append(Chunk(block_start, line_count))
+            block_start = i + 1
+        if kept is not None:
+            chunks[-1].end = old_chunks[kept].start
+            chunks.extend(old_chunks[kept:])
+        self.chunks = chunks
+        self.starts = [c.start for c in chunks]
+        if len(self.syntax_cache) > 2 * len(chunks) + 1000:
+            self.prune()
+
+    def prune(self):
+        """Forgets parses of blocks that are no longer in the document"""
+        current = {}
+        for chunk in self.chunks:
+            end = chunk.start
+            while end < chunk.end and self.lines[end]:
+                end += 1
+            source = '\n'.join(self.lines[chunk.start:end])
+            if source in self.syntax_cache:
+                current[source] = self.syntax_cache[source]
+        self.syntax_cache = current
+
+    def edit(self, change: dict):
+        """Applies a TextDocumentContentChangeEvent"""
+        if 'range' not in change:
+            self.lines = NEWLINE.split(change['text'])
+            self.chunks = []
+            self.split(0, 0, None)
+            return
+        start = change['range']['start']
+        end = change['range']['end']
+        first = min(start['line'], len(self.lines) - 1)
+        last = min(end['line'], len(self.lines) - 1)
+        before = self.lines[first][:from_utf16(self.lines[first], start['character'])]
+        after = self.lines[last][from_utf16(self.lines[last], end['character']):]
+        new_lines = NEWLINE.split(before + change['text'] + after)
+        self.lines[first:last + 1] = new_lines
+        delta = len(new_lines) - (last - first + 1)
+        # Re-split from the chunk before the edit (whose frames may grow if
+        # the edited sentence stops being one) to where chunks start as before
+        index = max(0, bisect.bisect_right(self.starts, first) - 2)
+        resync = {}
+        for j in range(bisect.bisect_right(self.starts, last), len(self.chunks)):
+            chunk = self.chunks[j]
+            chunk.start += delta
+            chunk.end += delta
+            resync[chunk.start] = j
+        self.split(index, first + len(new_lines) - 1, resync)
+
+    def diagnostics(self, warn_incomplete: bool=True,
+            result_cache: Optional[cache.Cache]=None) -> List[dict]:
+        """Checks the chunks that changed and returns all diagnostics"""
+        result = []
+        for chunk in self.chunks:
+            if chunk.diagnostics is None:
+                chunk.diagnostics = check_chunk(self.text(chunk),
+                        warn_incomplete, result_cache, self.syntax_cache)
+            for d in chunk.diagnostics:
+                if d.level not in SEVERITIES:
+                    continue
+                lineno = chunk.start + (d.line or 1) - 1
+                lineno = min(lineno, len(self.lines) - 1)
+                result.append({
+                    'range': {
+                        'start': {'line': lineno, 'character': 0},
+                        'end': {
+                            'line': lineno,
+                            'character': utf16_length(self.lines[lineno]),
+                        },
+                    },
+                    'severity': SEVERITIES[d.level],
+                    'code': d.code,
+                    'source': 'cusf',
+                    'message': d.message,
+                })
+        return result
+
+    def completions(self, position: dict) -> List[dict]:
+        lineno = position['line']
+        if lineno >= len(self.lines):
+            return []
+        line = self.lines[lineno]
+        cursor = from_utf16(line, position['character'])
+        m = LABEL.match(line)
+        if m is None or cursor < 1 or cursor > m.end():
+            return []
+        # Find the part of the label being typed
+        typed = line[1:cursor]
+        part_start = 1
+        part_index = 0
+        for sep_match in labels.SEPARATOR_PATTERN.finditer(typed):
+            part_start = sep_match.end() + 1
+            part_index += 1
+        prefix = line[part_start:cursor]
+        # Frame line or argument line?
+        block_start = lineno
+        while block_start > 0 and self.lines[block_start - 1]:
+            block_start -= 1
+        if block_start == lineno:
+            candidates = frame_label_completions(prefix)
+            kind = 13 # Enum
+        else:
+            frame = LABEL.match(self.lines[block_start])
+            frame_label = frame.group('label') if frame else ''
+            candidates = role_completions(frame_label, part_index)
+            kind = 5 # Field
+        edit_range = {
+            'start': {'line': lineno, 'character': utf16_length(line[:part_start])},
+            'end': position,
+        }
+        return [
+            {
+                'label': label,
+                'kind': kind,
+                'sortText': f'{i:05}',
+                'textEdit': {'range': edit_range, 'newText': label},
+            }
+            for i, label in enumerate(candidates)
+        ]
+
+
+def check_chunk(text: str, warn_incomplete: bool=True,
+        result_cache: Optional[cache.Cache]=None,
+        syntax_cache: Optional[check.SyntaxCache]=None) \
+        -> List[diagnostics.Diagnostic]:
+    """Checks a chunk, numbering its lines from 1"""
+    found = diagnostics.ListCollector()
+    try:
+        check.check_sentence(text, 1, None, warn_incomplete, result_cache,
+                syntax_cache, found)
+    except Exception as e:
+        found.add(diagnostics.Diagnostic(logging.ERROR,
+                'cannot-check-sentence', None, None, None, (str(e),)))
+    return found.diagnostics
+
+
+def frame_label_completions(prefix: str) -> List[str]:
+    """Frame labels, or once one is typed, it and its possible continuations"""
+    base = None
+    for i in range(len(prefix) + 1):
+        if (i == len(prefix) or prefix[i] == '-') \
+                and labels.parse_frame_label_part(prefix[:i]):
+            base = prefix[:i]
+    if base is None:
+        return list(labels.FRAMES)
+    frame, aspect, mode, polarity = labels.parse_frame_label_part(base)
+    if polarity:
+        options: Tuple[str, ...] = ()
+    elif mode:
+        options = labels.POLARITIES
+    elif aspect:
+        options = labels.MODES + labels.POLARITIES
+    else:
+        options = labels.ASPECTS + labels.MODES + labels.POLARITIES
+    return [base] + [f'{base}-{o}' for o in options]
+
+
+def role_completions(frame_label: str, part_index: int=0) -> List[str]:
+    """Roles for the given part of a frame label, core roles first"""
+    parts = labels.split_label(frame_label)
+    part = parts[part_index] if part_index < len(parts) else parts[-1]
+    parsed = labels.parse_frame_label_part(part)
+    if parsed is None:
+        core = sorted(set().union(*labels.CORE_ROLES.values()))
+    else:
+        frame, aspect, mode, polarity = parsed
+        core = sorted(labels.CORE_ROLES[frame, aspect])
+    noncore = sorted(labels.NONCORE_ROLES)
+    return core + [f'm-{r}' for r in noncore] + [f'x-{r}' for r in noncore]
+
+
+def read_message(stream: BinaryIO) -> Optional[dict]:
+    """Reads one JSON-RPC message, or returns None at the end of input"""
+    length = None
+    while True:
+        line = stream.readline()
+        if not line:
+            return None
+        line = line.strip()
+        if not line:
+            break
+        name, _, value = line.decode('ascii').partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    if length is None:
+        return None
+    return json.loads(stream.read(length))
+
+
+def write_message(stream: BinaryIO, message: dict):
+    body = json.dumps(message, ensure_ascii=False).encode()
+    stream.write(f'Content-Length: {len(body)}\r\n\r\n'.encode())
+    stream.write(body)
+    stream.flush()
+
+
+class Server:
+
+    def __init__(self, output: BinaryIO, warn_incomplete: bool=True):
+        self.output = output
+        self.warn_incomplete = warn_incomplete
+        self.result_cache = cache.MemoryCache()
+        self.documents: Dict[str, Document] = {}
+        self.dirty: Dict[str, Document] = {}
+        self.shutdown = False
+
+    def send(self, message: dict):
+        message['jsonrpc'] = '2.0'
+        write_message(self.output, message)
+
+    def publish(self):
+        """Sends diagnostics for the documents changed since the last call"""
+        for uri, document in self.dirty.items():
+            self.send({
+                'method': 'textDocument/publishDiagnostics',
+                'params': {
+                    'uri': uri,
+                    'version': document.version,
+                    'diagnostics': document.diagnostics(self.warn_incomplete,
+                            self.result_cache),
+                },
+            })
+        self.dirty.clear()
+
+    def handle(self, message: dict) -> bool:
+        """Handles a message, returning False once the client says exit"""
+        method = message.get('method')
+        params = message.get('params') or {}
+        if method == 'exit':
+            return False
+        if 'id' not in message:
+            if method is not None:
+                self.notify(method, params)
+            return True
+        try:
+            result = self.request(method, params)
+        except KeyError as e:
+            self.send({'id': message['id'], 'error': {'code': -32602,
+                    'message': f'invalid params: missing {e}'}})
+            return True
+        if result is NotImplemented:
+            self.send({'id': message['id'], 'error': {'code': -32601,
+                    'message': f'method not found: {method}'}})
+        else:
+            self.send({'id': message['id'], 'result': result})
+        return True
+
+    def request(self, method: str, params: dict) -> object:
+        if method == 'initialize':
+            return {
+                'capabilities': {
+                    'textDocumentSync': {'openClose': True, 'change': 2},
+                    'completionProvider': {'triggerCharacters': ['[', '-', ' ']},
+                },
+                'serverInfo': {'name': 'cusf'},
+            }
+        if method == 'shutdown':
+            self.shutdown = True
+            return None
+        if method == 'textDocument/completion':
+            document = self.documents.get(params['textDocument']['uri'])
+            if document is None:
+                return []
+            return {
+                'isIncomplete': False,
+                'items': document.completions(params['position']),
+            }
+        return NotImplemented
+
+    def notify(self, method: str, params: dict):
+        if method == 'textDocument/didOpen':
+            item = params['textDocument']
+            document = Document(item['uri'], item['text'], item.get('version'))
+            self.documents[item['uri']] = document
+            self.dirty[item['uri']] = document
+        elif method == 'textDocument/didChange':
+            uri = params['textDocument']['uri']
+            document = self.documents.get(uri)
+            if document is None:
+                return
+            for change in params['contentChanges']:
+                document.edit(change)
+            document.version = params['textDocument'].get('version')
+            self.dirty[uri] = document
+        elif method == 'textDocument/didClose':
+            uri = params['textDocument']['uri']
+            self.documents.pop(uri, None)
+            self.dirty.pop(uri, None)
+            self.send({
+                'method': 'textDocument/publishDiagnostics',
+                'params': {'uri': uri, 'diagnostics': []},
+            })
+
+
+def serve(input: BinaryIO, output: BinaryIO, warn_incomplete: bool=True) -> int:
+    """Runs the server until the client says exit, returning the exit code
+
+    Messages are read in a separate thread, so that diagnostics are only
+    computed once the messages sent so far (e.g. a burst of keystrokes) have
+    been handled."""
+    messages: queue.Queue = queue.Queue()
+    def reader():
+        while True:
+            message = read_message(input)
+            messages.put(message)
+            if message is None:
+                return
+    threading.Thread(target=reader, daemon=True).start()
+    server = Server(output, warn_incomplete)
+    while True:
+        if messages.empty():
+            server.publish()
+        message = messages.get()
+        if message is None or not server.handle(message):
+            break
+    return 0 if server.shutdown else 1
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        format='%(levelname)s %(message)s',
+        level=logging.INFO,
+    )
+    arg_parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--warn-incomplete',
+            action=argparse.BooleanOptionalAction, default=True)
+    args = arg_parser.parse_args()
+    code = serve(sys.stdin.buffer, sys.stdout.buffer, args.warn_incomplete)
+    # Do not wait for the reader thread, which may be blocked on input
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(code)
@@ -0,0 +1,103 @@
+"""Opt-in timing of the phases of filling and checking sentences
+
+Within `with profiling.enabled() as profile:`, the phases of Sentence.fill,
+the checks and the helpers they spend their time in are wrapped so that the
+wall time and number of calls of each are added up in profile. Outside, the
+original functions are in place, so profiling costs nothing when it is not
+used (not even the import of pyconll). Times are inclusive (a phase includes
+the helpers it calls) and include the overhead of the wrappers.
+"""
+
+
+import contextlib
+import functools
+import time
+from typing import Callable, Dict, Iterator, List, Tuple
+
+
+import conllu
+import cusf
+
+
+def targets() -> Tuple[Tuple[object, str, str], ...]:
+    """(owner, attribute, name in reports); phases first, then helpers"""
+    from pyconll.unit.sentence import Sentence as PyCoNLLSentence
+    return (
+        (cusf.Sentence, 'fill', 'fill'),
+        (cusf.Sentence, 'collect_syntactic_links', 'fill: syntactic links'),
+        (cusf.Sentence, 'collect_scene_links', 'fill: participant-scene links'),
+        (cusf.Sentence, 'collect_content_links', 'fill: topic-content links'),
+        (cusf.Sentence, 'remove_empty_frames', 'fill: remove empty frames'),
+        (cusf.Sentence, 'add_missing_frames', 'fill: add missing frames'),
+        (cusf.Sentence, 'check', 'check'),
+        (cusf.Frame, 'check', 'check: frame'),
+        (PyCoNLLSentence, 'to_tree', 'to_tree'),
+        (conllu.Sentence, 'to_tree', 'to_tree'),
+        (cusf, 'index_tree', 'index_tree'),
+        (cusf, 'index_spans', 'index_spans'),
+        (cusf.Sentence, 'tree_for_token', 'tree_for_token'),
+        (cusf.Sentence, 'predicate_text', 'predicate_text'),
+        (cusf.Sentence, 'argument_text', 'argument_text'),
+        (cusf.Sentence, 'deep_link_exists', 'deep_link_exists'),
+        (cusf.Sentence, 'reachable', 'reachable'),
+    )
+
+
+Profile = Dict[str, List[float]] # name -> [calls, seconds]
+
+
+def timed(fn: Callable, name: str, profile: Profile) -> Callable:
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            entry = profile[name]
+            entry[0] += 1
+            entry[1] += time.perf_counter() - start
+    return wrapper
+
+
+@contextlib.contextmanager
+def enabled() -> Iterator[Profile]:
+    """Profiles the targets while active, yielding the profile"""
+    wrapped = targets()
+    profile: Profile = {name: [0, 0.0] for _, _, name in wrapped}
+    originals = [(owner, attribute, owner.__dict__[attribute])
+            for owner, attribute, _ in wrapped]
+    try:
+        for (owner, attribute, name), (_, _, original) in zip(wrapped, originals):
+            setattr(owner, attribute, timed(original, name, profile))
+        yield profile
+    finally:
+        for owner, attribute, original in originals:
+            setattr(owner, attribute, original)
+
+
+def merge(profiles: List[Profile]) -> Profile:
+    total: Profile = {}
+    for profile in profiles:
+        for name, (calls, seconds) in profile.items():
+            entry = total.setdefault(name, [0, 0.0])
+            entry[0] += calls
+            entry[1] += seconds
+    return total
+
+
+def report(profile: Profile) -> List[str]:
+    """Formats a profile as table rows, hottest first, leaving out unused
+    targets
+
+    Percentages are of the time spent in fill and check."""
+    total = profile.get('fill', [0, 0.0])[1] + profile.get('check', [0, 0.0])[1]
+    rows = [f'{"ms":>9} {"%":>5} {"calls":>8} {"us/call":>8}  name']
+    entries: List[Tuple[str, List[float]]] = sorted(profile.items(),
+            key=lambda item: -item[1][1])
+    for name, (calls, seconds) in entries:
+        if not calls:
+            continue
+        share = seconds / total if total else 0.0
+        rows.append(f'{seconds * 1000:9.1f} {share:5.0%} {calls:8.0f} '
+                f'{seconds / calls * 1e6:8.1f}  {name}')
+    return rows
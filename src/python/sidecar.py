@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+
+
+"""Compiles CUSF files into binary sidecars for fast loading.
+
+The sidecar of FILE.cusf is FILE.cusf.bin. It holds the sentences, token
+columns, frames and args of the file as arrays of 32-bit indices into a
+string table. Loading memory-maps it and builds frames, and the syntax of
+sentences as conllu views (whatever cusf.syntax_backend is), straight from
+the arrays without parsing any text. The source of a sentence's CoNLL-U
+block is only stored if it cannot be written back exactly from its comments
+and columns, e.g. because of stray whitespace. A sidecar is only used if the
+source file's mtime and size, or failing that its SHA-256 hash, match the
+ones recorded in it; otherwise it is recompiled.
+"""
+
+
+import argparse
+import array
+import hashlib
+import io
+import mmap
+import os
+import struct
+import sys
+from typing import Dict, Iterable, List, Optional
+
+
+import blocks
+import conllu
+import corpus
+import cusf
+
+
+MAGIC = b'CUSFBIN\0'
+VERSION = 2
+HEADER = struct.Struct('<8sIQQ32s') # magic, version, mtime, size, hash
+SECTION_NAMES = ('string_offsets', 'strings', 'sentences', 'digests', 'tokens',
+        'frames', 'args')
+SECTIONS = struct.Struct(f'<{2 * len(SECTION_NAMES)}Q') # offset, length
+NONE = 0xffffffff # index for missing strings
+SENTENCE_FIELDS = 5 # line number, comments, source, first token, first frame
+DIGEST_SIZE = 32 # the SHA-256 hash of the sentence's source, per sentence
+TOKEN_FIELDS = 10 # the CoNLL-U columns
+FRAME_FIELDS = 6 # line number, head, text, label, comment, first arg
+ARG_FIELDS = 4 # head, text, label, comment
+
+
+def path_for(path: str) -> str:
+    return path + '.bin'
+
+
+def file_hash(path: str) -> bytes:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.digest()
+
+
+class StringTable:
+
+    def __init__(self):
+        self.index: Dict[str, int] = {}
+        self.data = io.BytesIO()
+        self.offsets = array.array('I', [0])
+
+    def add(self, string: Optional[str]) -> int:
+        if string is None:
+            return NONE
+        if string not in self.index:
+            self.index[string] = len(self.index)
+            self.data.write(string.encode())
+            self.offsets.append(self.data.tell())
+        return self.index[string]
+
+
+class Digest:
+    """A finished hash, standing in for a sentence's source_hash"""
+
+    __slots__ = ('value',)
+
+    def __init__(self, value: bytes):
+        self.value = value
+
+    def digest(self) -> bytes:
+        return self.value
+
+    def hexdigest(self) -> str:
+        return self.value.hex()
+
+
+def sentence_sources(text: str, sentences: List[cusf.Sentence]) \
+        -> Iterable[str]:
+    """Gives the text cusf.read hashed for each sentence
+
+    That is each block of the sentence followed by an empty line."""
+    starts = iter(s.lineno for s in sentences[1:])
+    next_start = next(starts, None)
+    source: List[str] = []
+    lineno = 1
+    for block in blocks.read(io.StringIO(text)):
+        if lineno == next_start:
+            yield ''.join(source)
+            source = []
+            next_start = next(starts, None)
+        source.append('\n'.join(block) + '\n\n')
+        lineno += len(block) + 1
+    if source:
+        yield ''.join(source)
+
+
+def compile(path: str) -> str:
+    """Writes the sidecar for a CUSF file, returns its path"""
+    stat = os.stat(path)
+    with open(path) as f:
+        text = f.read()
+    sentences = list(cusf.read(io.StringIO(text)))
+    strings = StringTable()
+    sentence_table = array.array('I')
+    digests = io.BytesIO()
+    token_table = array.array('I')
+    frame_table = array.array('I')
+    arg_table = array.array('I')
+    sources = sentence_sources(text, sentences)
+    for sentence, source in zip(sentences, sources):
+        block = source.split('\n\n', 1)[0]
+        lines = [line.strip() for line in block.split('\n')]
+        comments = [line for line in lines if line.startswith('#')]
+        token_lines = [line for line in lines
+                if line and not line.startswith('#')]
+        exact = block and comments + token_lines == block.split('\n')
+        sentence_table.extend((
+            sentence.lineno,
+            strings.add('\n'.join(comments)) if comments else NONE,
+            NONE if exact else strings.add(block),
+            len(token_table) // TOKEN_FIELDS,
+            len(frame_table) // FRAME_FIELDS,
+        ))
+        digests.write(hashlib.sha256(source.encode()).digest())
+        for line in token_lines:
+            token_table.extend(strings.add(c) for c in line.split('\t'))
+        for frame, lineno in zip(sentence.frames, sentence.frame_linenos):
+            if isinstance(frame, cusf.Frame):
+                frame_table.extend((lineno, strings.add(frame.head),
+                        strings.add(frame.text), strings.add(frame.label),
+                        strings.add(frame.comment),
+                        len(arg_table) // ARG_FIELDS))
+                for arg in frame.args:
+                    arg_table.extend((strings.add(arg.head),
+                            strings.add(arg.text), strings.add(arg.label),
+                            strings.add(arg.comment)))
+            else: # unparseable frame, stored as its lines in the text field
+                frame_table.extend((lineno, NONE, strings.add('\n'.join(frame)),
+                        NONE, NONE, len(arg_table) // ARG_FIELDS))
+    # Sentinels, so that counts are differences between consecutive entries
+    sentence_table.extend((0, NONE, NONE, len(token_table) // TOKEN_FIELDS,
+            len(frame_table) // FRAME_FIELDS))
+    frame_table.extend((0, NONE, NONE, NONE, NONE, len(arg_table) // ARG_FIELDS))
+    sections = [strings.offsets, strings.data.getvalue(), sentence_table,
+            digests.getvalue(), token_table, frame_table, arg_table]
+    if sys.byteorder != 'little':
+        for section in sections:
+            if isinstance(section, array.array):
+                section.byteswap()
+    sections = [bytes(s) if isinstance(s, bytes) else s.tobytes() for s in sections]
+    offsets = []
+    offset = HEADER.size + SECTIONS.size
+    for section in sections:
+        offset += -offset % 8
+        offsets.extend((offset, len(section)))
+        offset += len(section)
+    sidecar = path_for(path)
+    tmp = sidecar + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, stat.st_mtime_ns, stat.st_size,
+                file_hash(path)))
+        f.write(SECTIONS.pack(*offsets))
+        for offset, section in zip(offsets[::2], sections):
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(section)
+    os.replace(tmp, sidecar)
+    return sidecar
+
+
+class Sidecar:
+    """A memory-mapped sidecar
+
+    The index tables, which make up most of the file, are read straight from
+    the mapping. The string table is decoded in one go when the sidecar is
+    opened: loading a file looks up nearly every string anyway, and decoding
+    strings one by one on demand made loading all of data/ 1.3x slower."""
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = view = memoryview(self.mmap)
+        self.magic, self.version, self.mtime_ns, self.size, self.hash = \
+                HEADER.unpack_from(view)
+        if self.magic != MAGIC or self.version != VERSION:
+            raise ValueError(f'{path} is not a version {VERSION} sidecar')
+        offsets = SECTIONS.unpack_from(view, HEADER.size)
+        for name, offset, length in zip(SECTION_NAMES, offsets[::2], offsets[1::2]):
+            section = view[offset:offset + length]
+            if name not in ('strings', 'digests'):
+                section = section.cast('I')
+            setattr(self, name, section)
+        offsets = self.string_offsets.tolist()
+        data = bytes(self.strings)
+        self.string_list: List[str] = [sys.intern(data[start:end].decode())
+                for start, end in zip(offsets, offsets[1:])]
+
+    def string(self, index: int) -> Optional[str]:
+        return None if index == NONE else self.string_list[index]
+
+    def __len__(self) -> int:
+        return len(self.sentences) // SENTENCE_FIELDS - 1
+
+    def syntax(self, comments: int, start: int, end: int) -> conllu.Conll:
+        """Builds the sentence made of tokens start to end as a view"""
+        string_list = self.string_list
+        columns = [[string_list[j] for j in self.tokens[
+                start * TOKEN_FIELDS + c:end * TOKEN_FIELDS:TOKEN_FIELDS]]
+                for c in range(TOKEN_FIELDS)]
+        comment_lines = [] if comments == NONE \
+                else string_list[comments].split('\n')
+        return conllu.Conll([conllu.Sentence.from_columns(comment_lines,
+                columns)])
+
+    def frame(self, f: int) -> cusf.Frameish:
+        base = f * FRAME_FIELDS
+        _, head, text, label, comment, first_arg = self.frames[base:base + FRAME_FIELDS]
+        if head == NONE:
+            return self.string(text).split('\n')
+        frame = cusf.Frame(self.string(head), self.string(text),
+                self.string(label), self.string(comment))
+        end_arg = self.frames[base + FRAME_FIELDS + 5]
+        for a in range(first_arg, end_arg):
+            base = a * ARG_FIELDS
+            frame.args.append(cusf.Arg(*(self.string(j)
+                    for j in self.args[base:base + ARG_FIELDS])))
+        return frame
+
+    def sentence(self, i: int) -> cusf.Sentence:
+        base = i * SENTENCE_FIELDS
+        lineno, comments, source, first_token, first_frame = \
+                self.sentences[base:base + SENTENCE_FIELDS]
+        end_token = self.sentences[base + SENTENCE_FIELDS + 3]
+        end_frame = self.sentences[base + SENTENCE_FIELDS + 4]
+        if source == NONE:
+            syntax = self.syntax(comments, first_token, end_token)
+        else:
+            syntax = conllu.load_from_string(self.string(source))
+        sentence = cusf.Sentence(syntax, lineno)
+        sentence.source_hash = Digest(
+                bytes(self.digests[i * DIGEST_SIZE:(i + 1) * DIGEST_SIZE]))
+        for f in range(first_frame, end_frame):
+            sentence.frames.append(self.frame(f))
+            sentence.frame_linenos.append(self.frames[f * FRAME_FIELDS])
+        return sentence
+
+    def __iter__(self) -> Iterable[cusf.Sentence]:
+        for i in range(len(self)):
+            yield self.sentence(i)
+
+    def close(self):
+        for name in SECTION_NAMES:
+            getattr(self, name).release()
+        self.view.release()
+        self.mmap.close()
+
+
+def is_fresh(sidecar: Sidecar, path: str) -> bool:
+    stat = os.stat(path)
+    if stat.st_mtime_ns == sidecar.mtime_ns and stat.st_size == sidecar.size:
+        return True
+    return stat.st_size == sidecar.size and file_hash(path) == sidecar.hash
+
+
+def open_sidecar(path: str) -> Sidecar:
+    """Opens the sidecar of a CUSF file, (re)compiling it if necessary"""
+    sidecar_path = path_for(path)
+    try:
+        sidecar = Sidecar(sidecar_path)
+    except (OSError, ValueError, struct.error):
+        pass
+    else:
+        if is_fresh(sidecar, path):
+            return sidecar
+        sidecar.close()
+    return Sidecar(compile(path))
+
+
+def load(path: str) -> Iterable[cusf.Sentence]:
+    """Like cusf.read on the file, but via its sidecar"""
+    sidecar = open_sidecar(path)
+    try:
+        yield from sidecar
+    finally:
+        sidecar.close()
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('path', nargs='+',
+            help='CUSF files, directories or glob patterns')
+    arg_parser.add_argument('--force', action='store_true',
+            help='recompile even if the sidecar is up to date')
+    args = arg_parser.parse_args()
+    for path in corpus.find_files(args.path):
+        if args.force:
+            compile(path)
+        else:
+            open_sidecar(path).close()
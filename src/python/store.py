@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+
+
+"""Loads CUSF files into an SQLite database for querying.
+
+    store.py import data/
+    store.py query --frame SCENE --arg-label m-depictive --file '*/pud/en/*'
+    store.py query --lemma sagen
+    store.py sql 'SELECT label, COUNT(*) FROM arg_labels GROUP BY label'
+    store.py export data/pud/en/000.cusf
+
+Files are identified by their real paths, so the database can be used from
+any directory. Only files that changed since they were last imported are
+re-imported, and files that no longer exist are dropped if they are under a
+path given to import. The database keeps the exact bytes of each file, so
+export reproduces it byte-for-byte. Labels are also stored split into their
+parts (as separated by >> and ||), so a query for one label also finds
+combined labels containing it.
+"""
+
+
+import argparse
+import fnmatch
+import glob
+import hashlib
+import io
+import os
+import sqlite3
+import sys
+from typing import Iterable, List, Optional, Tuple
+
+
+import cache
+import corpus
+import cusf
+import labels
+
+
+DEFAULT_PATH = os.path.join(cache.CACHE_DIR, 'store.sqlite3')
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS files (
+        id INTEGER PRIMARY KEY,
+        path TEXT NOT NULL UNIQUE,
+        mtime_ns INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        hash BLOB NOT NULL,
+        prefix BLOB NOT NULL -- bytes before the first sentence
+    );
+    CREATE TABLE IF NOT EXISTS sentences (
+        id INTEGER PRIMARY KEY,
+        file_id INTEGER NOT NULL REFERENCES files (id) ON DELETE CASCADE,
+        position INTEGER NOT NULL,
+        lineno INTEGER NOT NULL,
+        sent_id TEXT,
+        text TEXT,
+        source BLOB NOT NULL -- the bytes up to the next sentence
+    );
+    CREATE INDEX IF NOT EXISTS sentences_file ON sentences (file_id, position);
+    CREATE TABLE IF NOT EXISTS tokens (
+        sentence_id INTEGER NOT NULL REFERENCES sentences (id) ON DELETE CASCADE,
+        id TEXT NOT NULL,
+        form TEXT,
+        lemma TEXT,
+        upos TEXT,
+        xpos TEXT,
+        head TEXT,
+        deprel TEXT,
+        PRIMARY KEY (sentence_id, id)
+    );
+    CREATE INDEX IF NOT EXISTS tokens_lemma ON tokens (lemma);
+    CREATE INDEX IF NOT EXISTS tokens_deprel ON tokens (deprel);
+    CREATE TABLE IF NOT EXISTS frames (
+        id INTEGER PRIMARY KEY,
+        sentence_id INTEGER NOT NULL REFERENCES sentences (id) ON DELETE CASCADE,
+        lineno INTEGER NOT NULL,
+        head TEXT NOT NULL,
+        text TEXT NOT NULL,
+        label TEXT NOT NULL,
+        comment TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS frames_sentence ON frames (sentence_id, head);
+    CREATE INDEX IF NOT EXISTS frames_label ON frames (label);
+    CREATE TABLE IF NOT EXISTS frame_labels (
+        frame_id INTEGER NOT NULL REFERENCES frames (id) ON DELETE CASCADE,
+        label TEXT NOT NULL, -- one part of the frame label, e.g. SCENE-NEG
+        type TEXT NOT NULL -- the frame of the part, e.g. SCENE
+    );
+    CREATE INDEX IF NOT EXISTS frame_labels_label ON frame_labels (label);
+    CREATE INDEX IF NOT EXISTS frame_labels_type ON frame_labels (type);
+    CREATE INDEX IF NOT EXISTS frame_labels_frame ON frame_labels (frame_id);
+    CREATE TABLE IF NOT EXISTS args (
+        id INTEGER PRIMARY KEY,
+        frame_id INTEGER NOT NULL REFERENCES frames (id) ON DELETE CASCADE,
+        lineno INTEGER NOT NULL,
+        head TEXT NOT NULL,
+        text TEXT NOT NULL,
+        label TEXT NOT NULL,
+        comment TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS args_frame ON args (frame_id);
+    CREATE INDEX IF NOT EXISTS args_label ON args (label);
+    CREATE TABLE IF NOT EXISTS arg_labels (
+        arg_id INTEGER NOT NULL REFERENCES args (id) ON DELETE CASCADE,
+        label TEXT NOT NULL -- one part of the arg label
+    );
+    CREATE INDEX IF NOT EXISTS arg_labels_label ON arg_labels (label);
+    CREATE INDEX IF NOT EXISTS arg_labels_arg ON arg_labels (arg_id);
+'''
+
+
+def connect(path: str=DEFAULT_PATH) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    db = sqlite3.connect(path, timeout=60)
+    db.execute('PRAGMA foreign_keys = ON')
+    db.executescript(SCHEMA)
+    return db
+
+
+def split_sources(data: bytes, sentences: List[cusf.Sentence]) \
+        -> Tuple[bytes, List[bytes]]:
+    """Cuts a file into the bytes before the first sentence and each sentence
+
+    Each sentence extends up to the next one, so the pieces concatenate to
+    the whole file."""
+    lines = data.splitlines(keepends=True) # same line breaks as text mode
+    starts = [s.lineno - 1 for s in sentences] + [len(lines)]
+    prefix = b''.join(lines[:starts[0]])
+    sources = [b''.join(lines[start:end])
+            for start, end in zip(starts, starts[1:])]
+    return prefix, sources
+
+
+def import_file(db: sqlite3.Connection, path: str) -> bool:
+    """Imports a file unless it is unchanged, returns whether it was"""
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+    row = db.execute('SELECT id, mtime_ns, size, hash FROM files WHERE path = ?',
+            (path,)).fetchone()
+    if row and row[1] == stat.st_mtime_ns and row[2] == stat.st_size:
+        return False
+    with open(path, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha256(data).digest()
+    if row and row[3] == digest:
+        db.execute('UPDATE files SET mtime_ns = ?, size = ? WHERE id = ?',
+                (stat.st_mtime_ns, stat.st_size, row[0]))
+        return False
+    if row:
+        db.execute('DELETE FROM files WHERE id = ?', (row[0],))
+    text = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8')
+    sentences = list(cusf.read(text))
+    prefix, sources = split_sources(data, sentences)
+    file_id = db.execute('INSERT INTO files (path, mtime_ns, size, hash, prefix) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (path, stat.st_mtime_ns, stat.st_size, digest, prefix)).lastrowid
+    for position, (sentence, source) in enumerate(zip(sentences, sources)):
+        if not len(sentence.syntax): # empty blocks read as empty sentences
+            db.execute('INSERT INTO sentences (file_id, position, lineno, '
+                    'source) VALUES (?, ?, ?, ?)',
+                    (file_id, position, sentence.lineno, source))
+            continue
+        syntax = sentence.syntax[0]
+        sentence_id = db.execute('INSERT INTO sentences (file_id, position, '
+                'lineno, sent_id, text, source) VALUES (?, ?, ?, ?, ?, ?)',
+                (file_id, position, sentence.lineno, syntax.id, syntax.text,
+                source)).lastrowid
+        db.executemany('INSERT OR IGNORE INTO tokens VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                ((sentence_id, t.id, t.form, t.lemma, t.upos, t.xpos, t.head,
+                t.deprel) for t in syntax))
+        for frame, lineno in zip(sentence.frames, sentence.frame_linenos):
+            if not isinstance(frame, cusf.Frame):
+                continue # unparseable, only kept in the source
+            frame_id = db.execute('INSERT INTO frames (sentence_id, lineno, '
+                    'head, text, label, comment) VALUES (?, ?, ?, ?, ?, ?)',
+                    (sentence_id, lineno, frame.head, frame.text, frame.label,
+                    frame.comment)).lastrowid
+            if frame.label:
+                db.executemany('INSERT INTO frame_labels VALUES (?, ?, ?)',
+                        ((frame_id, part, part.split('-')[0])
+                        for part in labels.split_label(frame.label)))
+            for i, arg in enumerate(frame.args, 1):
+                arg_id = db.execute('INSERT INTO args (frame_id, lineno, head, '
+                        'text, label, comment) VALUES (?, ?, ?, ?, ?, ?)',
+                        (frame_id, lineno + i, arg.head, arg.text, arg.label,
+                        arg.comment)).lastrowid
+                if arg.label:
+                    db.executemany('INSERT INTO arg_labels VALUES (?, ?)',
+                            ((arg_id, part)
+                            for part in labels.split_label(arg.label)))
+    return True
+
+
+def is_under(path: str, root: str) -> bool:
+    """Tells whether a real path is, or is below, a file, directory or glob
+    pattern as given on the command line"""
+    real_root = os.path.realpath(root)
+    if glob.has_magic(root):
+        return fnmatch.fnmatchcase(path, real_root)
+    return path == real_root or path.startswith(real_root.rstrip(os.sep) + os.sep)
+
+
+def import_files(db: sqlite3.Connection, paths: Iterable[str],
+        roots: Iterable[str]=()) -> Iterable[Tuple[str, bool]]:
+    """Imports files, dropping those under roots that no longer exist from
+    the database
+
+    Yields each path with whether it was (re-)imported."""
+    roots = list(roots)
+    for path, in db.execute('SELECT path FROM files').fetchall():
+        if not os.path.exists(path) \
+                and any(is_under(path, root) for root in roots):
+            db.execute('DELETE FROM files WHERE path = ?', (path,))
+    for path in paths:
+        imported = import_file(db, path)
+        db.commit()
+        yield path, imported
+
+
+def export_file(db: sqlite3.Connection, path: str, out: io.BufferedIOBase):
+    path = os.path.realpath(path)
+    row = db.execute('SELECT id, prefix FROM files WHERE path = ?',
+            (path,)).fetchone()
+    if row is None:
+        raise KeyError(path)
+    file_id, prefix = row
+    out.write(prefix)
+    for source, in db.execute('SELECT source FROM sentences WHERE file_id = ? '
+            'ORDER BY position', (file_id,)):
+        out.write(source)
+
+
+def query(db: sqlite3.Connection, file: Optional[str]=None,
+        frame: Optional[str]=None, lemma: Optional[str]=None,
+        deprel: Optional[str]=None, arg_label: Optional[str]=None,
+        arg_lemma: Optional[str]=None, arg_deprel: Optional[str]=None) \
+        -> Iterable[Tuple[str, int, str, str, str, str]]:
+    """Finds frames, or args if any arg condition is given
+
+    frame matches a part of the frame label or its frame, e.g. SCENE-NEG or
+    SCENE. lemma and deprel are those of the frame head, arg_lemma and
+    arg_deprel of the arg head, and file is a glob pattern. Yields (path,
+    lineno, label, text, head, comment) tuples in file order."""
+    joins = []
+    conditions = []
+    params: List[str] = []
+    def token_join(alias: str, head: str, lemma: Optional[str],
+            deprel: Optional[str]):
+        if lemma is None and deprel is None:
+            return
+        joins.append(f'JOIN tokens AS {alias} ON {alias}.sentence_id = '
+                f'sentences.id AND {alias}.id = {head}')
+        for column, value in (('lemma', lemma), ('deprel', deprel)):
+            if value is not None:
+                conditions.append(f'{alias}.{column} = ?')
+                params.append(value)
+    if file is not None:
+        conditions.append('files.path GLOB ?')
+        params.append(file)
+    if frame is not None:
+        conditions.append('frames.id IN (SELECT frame_id FROM frame_labels '
+                'WHERE label = ? OR type = ?)')
+        params.extend((frame, frame))
+    token_join('head_token', 'frames.head', lemma, deprel)
+    by_arg = arg_label is not None or arg_lemma is not None \
+            or arg_deprel is not None
+    if by_arg:
+        joins.append('JOIN args ON args.frame_id = frames.id')
+    if arg_label is not None:
+        conditions.append('args.id IN (SELECT arg_id FROM arg_labels '
+                'WHERE label = ?)')
+        params.append(arg_label)
+    token_join('arg_token', 'args.head', arg_lemma, arg_deprel)
+    unit = 'args' if by_arg else 'frames'
+    sql = f'''
+        SELECT files.path, {unit}.lineno, {unit}.label, {unit}.text,
+                {unit}.head, {unit}.comment
+        FROM files
+        JOIN sentences ON sentences.file_id = files.id
+        JOIN frames ON frames.sentence_id = sentences.id
+        {' '.join(joins)}
+        {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+        ORDER BY files.path, {unit}.lineno
+    '''
+    return db.execute(sql, params)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--db', metavar='FILE', default=DEFAULT_PATH,
+            help=f'database file (default: {DEFAULT_PATH})')
+    subparsers = arg_parser.add_subparsers(dest='command', required=True)
+    import_parser = subparsers.add_parser('import',
+            help='import changed CUSF files')
+    import_parser.add_argument('path', nargs='+',
+            help='CUSF files, directories or glob patterns')
+    query_parser = subparsers.add_parser('query',
+            help='list matching frames, or args if an --arg-* option is given')
+    query_parser.add_argument('--file', metavar='GLOB')
+    query_parser.add_argument('--frame', metavar='LABEL',
+            help='frame label part or frame, e.g. SCENE-NEG or SCENE')
+    query_parser.add_argument('--lemma', help='lemma of the frame head')
+    query_parser.add_argument('--deprel', help='deprel of the frame head')
+    query_parser.add_argument('--arg-label', metavar='LABEL',
+            help='arg label part, e.g. m-depictive')
+    query_parser.add_argument('--arg-lemma', metavar='LEMMA')
+    query_parser.add_argument('--arg-deprel', metavar='DEPREL')
+    sql_parser = subparsers.add_parser('sql', help='run an SQL query')
+    sql_parser.add_argument('query')
+    export_parser = subparsers.add_parser('export',
+            help='write an imported file to standard output')
+    export_parser.add_argument('path')
+    args = arg_parser.parse_args()
+    db = connect(args.db)
+    if args.command == 'import':
+        for path, imported in import_files(db, corpus.find_files(args.path),
+                args.path):
+            if imported:
+                print(f'imported {path}', file=sys.stderr)
+    elif args.command == 'query':
+        for path, lineno, label, text, head, comment in query(db, args.file,
+                args.frame, args.lemma, args.deprel, args.arg_label,
+                args.arg_lemma, args.arg_deprel):
+            comment = f' # {comment}' if comment else ''
+            print(f'{path}:{lineno}: [{label}] {text} ({head}){comment}')
+    elif args.command == 'sql':
+        for row in db.execute(args.query):
+            print('\t'.join('' if v is None else str(v) for v in row))
+    elif args.command == 'export':
+        try:
+            export_file(db, args.path, sys.stdout.buffer)
+        except KeyError:
+            arg_parser.error(f'not imported: {args.path}')
+    db.close()